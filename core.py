@@ -1,50 +1,2040 @@
+import bisect
+import io
+import json
+import mmap
 import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 import chess
 import chess.pgn
+import chess.polyglot
+import numpy as np
 from easygui import fileopenbox, filesavebox
 
+BOM = b"\xef\xbb\xbf"
+TAG_REGEX = re.compile(rb'^\[([A-Za-z0-9_]+)\s+"([^\r]*)"\]\s*$')
+SKIP_MOVETEXT_REGEX = re.compile(rb"[{};]")
+CHUNK_SIZE = 1 << 20
+MEMORY_BUDGET = 64 << 20
+# Read once since it can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def scan_games(fin, tags=()):
+    """
+    Finds where every game of a pgn starts without parsing any moves.
+
+    The game boundaries are the same as the ones ``chess.pgn.read_game``
+    would find when reading the file from the start.
+
+    :param fin: the pgn file opened in binary mode
+    :param tags: the names of the header tags to read, None for every tag
+    :return: a generator of (byte offset, {tag name: value}) of each game
+    """
+    if tags is not None:
+        tags = {t.encode(): t for t in tags}
+    seeking, headers, after_headers, moves = range(4)
+    state = seeking
+    in_comment = False
+    offset = 0
+    game = None
+    for line in fin:
+        start, offset = offset, offset + len(line)
+        if start == 0:
+            line = line[len(BOM) :] if line.startswith(BOM) else line
+
+        if state == seeking:
+            if line.isspace() or line[:1] in b"%;":
+                continue
+            if game is not None:
+                yield game
+            game_tags = dict()
+            game = (start, game_tags)
+            state = headers
+
+        if state == headers:
+            if line[:1] in b"%;":
+                continue
+            tag_match = TAG_REGEX.match(line)
+            if tag_match:
+                if tags is None:
+                    name = tag_match.group(1).decode()
+                else:
+                    name = tags.get(tag_match.group(1))
+                if name is not None:
+                    game_tags[name] = tag_match.group(2).decode(errors="replace")
+                continue
+            if line.isspace():
+                state = after_headers
+                continue
+            state = moves
+
+        elif state == after_headers:
+            state = moves
+
+        if not in_comment:
+            if line.isspace():
+                state = seeking
+                continue
+            elif line.startswith(b"%"):
+                continue
+
+        if in_comment or b"{" in line or b";" in line:
+            for match in SKIP_MOVETEXT_REGEX.finditer(line):
+                token = match.group(0)
+                if token == b"{":
+                    in_comment = True
+                elif not in_comment and token == b";":
+                    break
+                elif token == b"}":
+                    in_comment = False
+
+    if game is not None:
+        yield game
+
+
+class ImportProgress:
+    """How far the scan of a pgn is, as passed to the progress callbacks"""
+
+    __slots__ = ("size", "done", "games", "start")
+
+    def __init__(self, size):
+        self.size = size
+        self.done = 0
+        self.games = 0
+        self.start = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return max(time.monotonic() - self.start, 1e-9)
+
+    @property
+    def fraction(self):
+        return self.done / self.size if self.size else 1.0
+
+    @property
+    def bytes_per_second(self):
+        return self.done / self.elapsed
+
+    @property
+    def games_per_second(self):
+        return self.games / self.elapsed
+
+
+def scan_file(file, tags=(), progress=None, chunk_size=CHUNK_SIZE, interval=0.1):
+    """
+    Streams the index entries of a pgn, see ``scan_games``.
+
+    The file is read in buffered chunks of ``chunk_size`` bytes, so only one
+    chunk and the game being scanned are in memory at once.
+
+    :param file: the path of the pgn
+    :param tags: the names of the header tags to read, None for every tag
+    :param progress: a function called with the ``ImportProgress`` at most
+                     every ``interval`` seconds and once at the end
+    :param chunk_size: the size of the reads
+    :param interval: the least amount of seconds between progress calls
+    :return: a generator of (byte offset, {tag name: value}) of each game
+    """
+    with open(file, "rb", buffering=chunk_size) as fin:
+        state = ImportProgress(os.fstat(fin.fileno()).st_size)
+        last = state.start
+        for entry in scan_games(fin, tags):
+            state.done = entry[0]
+            state.games += 1
+            if progress is not None and time.monotonic() - last >= interval:
+                last = time.monotonic()
+                progress(state)
+            yield entry
+        state.done = fin.tell()
+    if progress is not None:
+        progress(state)
+
+
+def read_tags(data):
+    """
+    Reads the header tags at the start of a game without parsing its moves.
+
+    :param data: the bytes of the game
+    :return: the {tag name: value} headers
+    """
+    tags = dict()
+    for line in data.lstrip(BOM).splitlines():
+        if line[:1] in (b"%", b";"):
+            continue
+        if not line.strip():
+            if tags:
+                break
+            continue
+        tag_match = TAG_REGEX.match(line)
+        if not tag_match:
+            break
+        tags[tag_match.group(1).decode()] = tag_match.group(2).decode(errors="replace")
+    return tags
+
+
+def parse_chunk(file, start, end, count, func):
+    """
+    Parses consecutive games of a pgn, used by the ``Database.map`` workers.
+
+    :param file: the path of the pgn
+    :param start: the byte offset of the first game
+    :param end: the byte offset after the last game
+    :param count: the amount of games in the chunk
+    :param func: the function to apply to each ``chess.pgn.Game``
+    :return: the list of the results of ``func``
+    """
+    with open(file, "rb") as fin:
+        fin.seek(start)
+        text = fin.read(end - start).decode("utf-8", errors="replace")
+    handle = io.StringIO(text)
+    return [func(chess.pgn.read_game(handle)) for _ in range(count)]
+
+
+def unpack_chunk(file, start, end, func):
+    """
+    Decodes consecutive games of a ``PackedDatabase``, see ``parse_chunk``.
+
+    :param file: the path of the database
+    :param start: the index of the first game
+    :param end: the index after the last game
+    :param func: the function to apply to each ``chess.pgn.Game``
+    :return: the list of the results of ``func``
+    """
+    database = PackedDatabase.open(file)
+    try:
+        games = (database.game(item) for item in range(start, end))
+        return [
+            func(game.unpack() if isinstance(game, PackedGame) else game)
+            for game in games
+        ]
+    finally:
+        database.close()
+
+
+def copy_mode(source, target):
+    """
+    Gives a temporary file the permissions of the file it replaces.
+
+    :param source: the path of the replaced file, when it doesn't exist the
+                   permissions of a new file are used
+    :param target: the path of the temporary file
+    :return: None
+    """
+    if os.path.isfile(source):
+        shutil.copymode(source, target)
+    else:
+        os.chmod(target, 0o666 & ~UMASK)
+
+
+def write_sidecar(path, header, sections, replace=os.replace):
+    """
+    Writes a binary file next to a pgn.
+
+    The file replaces ``path`` in one go since the old one might be
+    memory-mapped elsewhere.
+
+    :param path: the path of the file
+    :param header: the packed header
+    :param sections: the buffers or binary files to write after the header,
+                     each padded to a multiple of 8 bytes
+    :param replace: the function moving the written temporary file to
+                    ``path``, which can release the old file first
+    :return: None
+    """
+    handle, temp = tempfile.mkstemp(".tmp", dir=os.path.dirname(path) or None)
+    try:
+        with open(handle, "wb") as fout:
+            for section in (header, *sections):
+                try:
+                    section.seek(0)
+                    shutil.copyfileobj(section, fout)
+                    length = section.tell()
+                except AttributeError:
+                    length = fout.write(section)
+                fout.write(bytes(-length % 8))
+        copy_mode(path, temp)
+        replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def pack_strings(strings):
+    """
+    Packs a string table.
+
+    :param strings: the strings
+    :return: the ``Q`` offset of each string plus the end and the utf-8 blob
+    """
+    blob = bytearray()
+    string_offsets = array("Q", [0])
+    for string in strings:
+        blob += string.encode()
+        string_offsets.append(len(blob))
+    return string_offsets, blob
+
+
+def map_sidecar(path, header, layout):
+    """
+    Memory-maps a binary file written by ``write_sidecar``.
+
+    :param path: the path of the file
+    :param header: the ``struct.Struct`` of the header
+    :param layout: a function of the unpacked header returning the
+                   (format, amount) of each section, it raises ValueError
+                   if the header is invalid
+    :return: the mmap, the unpacked header and a memoryview of each section
+             plus one of the remaining bytes
+    :raises ValueError: if the file is invalid
+    """
+    with open(path, "rb") as fin:
+        mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        fields = header.unpack_from(mm)
+        bounds = []
+        pos = header.size + -header.size % 8
+        for fmt, amount in layout(fields):
+            end = pos + struct.calcsize(fmt) * amount
+            bounds.append((fmt, pos, end))
+            pos = end + -end % 8
+        if pos > len(mm):
+            raise ValueError("file is truncated")
+    except (struct.error, ValueError):
+        mm.close()
+        raise
+
+    with memoryview(mm) as view:
+        sections = [view[start:end].cast(fmt) for fmt, start, end in bounds]
+        sections.append(view[pos:])
+    return mm, fields, sections
+
+
+class PackedGame:
+    """
+    A game stored compactly while it isn't being edited.
+
+    The moves are packed in an ``array("H")`` in the order they would be in a
+    pgn, each as from square | to square << 6 | promotion << 12, with
+    ``VARIATION_START`` and ``VARIATION_END`` around side variations. The
+    nodes are numbered in the same order, the game being 0, to keep the
+    comments and nags in side tables.
+    """
+
+    VARIATION_START = 0xFFFE
+    VARIATION_END = 0xFFFF
+    MOVES = dict()
+
+    __slots__ = ("headers", "moves", "comments", "starting_comments", "nags")
+
+    def __init__(self, headers, moves, comments, starting_comments, nags):
+        self.headers = headers
+        self.moves = moves
+        self.comments = comments
+        self.starting_comments = starting_comments
+        self.nags = nags
+
+    @classmethod
+    def pack(cls, game):
+        """
+        Packs a game.
+
+        :param game: the ``chess.pgn.Game``
+        :return: the ``PackedGame``
+        :raises ValueError: if the game has drop moves
+        """
+        packed = cls(dict(game.headers), array("H"), dict(), dict(), dict())
+        moves = packed.moves
+        number = 0
+
+        def annotate(node):
+            if node.comment:
+                packed.comments[number] = node.comment
+            if node.starting_comment:
+                packed.starting_comments[number] = node.starting_comment
+            if node.nags:
+                packed.nags[number] = tuple(node.nags)
+
+        def pack_move(node):
+            nonlocal number
+            move = node.move
+            if move.drop:
+                raise ValueError("can not pack drop moves")
+            moves.append(
+                move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+            )
+            number += 1
+            annotate(node)
+
+        def pack_variations(node):
+            while node.variations:
+                main = node.variations[0]
+                pack_move(main)
+                for side in node.variations[1:]:
+                    moves.append(cls.VARIATION_START)
+                    pack_move(side)
+                    pack_variations(side)
+                    moves.append(cls.VARIATION_END)
+                node = main
+
+        if game.comment:
+            packed.comments[0] = game.comment
+        if game.nags:
+            packed.nags[0] = tuple(game.nags)
+        pack_variations(game)
+        return packed
+
+    def unpack(self):
+        """
+        Rebuilds the game tree.
+
+        :return: the ``chess.pgn.Game``
+        """
+        game = chess.pgn.Game(self.headers)
+        game.comment = self.comments.get(0, "")
+        game.nags = set(self.nags.get(0, ()))
+        moves = self.MOVES
+        start, end = self.VARIATION_START, self.VARIATION_END
+        comments, starting_comments, nags = (
+            self.comments,
+            self.starting_comments,
+            self.nags,
+        )
+        stack = []
+        node = game
+        number = 0
+        for code in self.moves:
+            if code == start:
+                stack.append(node)
+                node = node.parent
+            elif code == end:
+                node = stack.pop()
+            else:
+                try:
+                    move = moves[code]
+                except KeyError:
+                    promotion = code >> 12 or None
+                    move = moves[code] = chess.Move(code & 63, code >> 6 & 63, promotion)
+                node = node.add_variation(move)
+                number += 1
+                if number in comments:
+                    node.comment = comments[number]
+                if number in starting_comments:
+                    node.starting_comment = starting_comments[number]
+                if number in nags:
+                    node.nags = set(nags[number])
+        return game
+
+
+def pack_game(game):
+    """Packs a game if it isn't packed and has no drop moves"""
+    if isinstance(game, PackedGame):
+        return game
+    try:
+        return PackedGame.pack(game)
+    except ValueError:
+        return game
+
+
+def unpack_game(game):
+    """Unpacks a game if it is packed"""
+    if isinstance(game, PackedGame):
+        return game.unpack()
+    return game
+
+
+class StringTable:
+    """Read only sequence of the strings packed in an index file"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded = dict()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        try:
+            return self.decoded[item]
+        except KeyError:
+            start, end = self.offsets[item], self.offsets[item + 1]
+            string = self.decoded[item] = bytes(self.blob[start:end]).decode()
+            return string
+
+    def find(self, string):
+        """
+        Returns the id of a string without decoding the table.
+
+        :param string: the string to look for
+        :return: the id, None if the string is not in the table
+        """
+        data = string.encode()
+        pattern = re.compile(re.escape(data))
+        offsets = self.offsets
+        match = pattern.search(self.blob)
+        while match is not None:
+            start = match.start()
+            item = bisect.bisect_left(offsets, start)
+            if item < len(self) and offsets[item] == start:
+                if offsets[item + 1] == start + len(data):
+                    return item
+            match = pattern.search(self.blob, start + 1)
+        return None
+
+
+class GameIndex:
+    """
+    The byte offset, length and main headers of every game in a pgn.
+
+    The index can be saved to a sidecar file next to the pgn which is
+    memory-mapped when it is loaded again, so opening an indexed pgn doesn't
+    depend on the amount of games in it.
+
+    Layout of the sidecar (native byte order):
+      * header: magic, version, tags per game, pgn size, pgn mtime,
+        game count, string count
+      * offsets: ``Q`` per game
+      * lengths: ``I`` per game
+      * tags: ``I`` string id per tag per game, padded to 8 bytes
+      * string offsets: ``Q`` per string + 1
+      * strings: utf-8 blob
+    """
+
+    MAGIC = b"WCIDX\x00\x00\x00"
+    VERSION = 2
+    TAGS = (*chess.pgn.TAG_ROSTER, "WhiteElo", "BlackElo", "ECO")
+    HEADER = struct.Struct("=8sIIQqQQ")
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.tags = array("I")
+        self.strings = []
+        self.string_ids = dict()
+        self.mmap = None
+
+    @classmethod
+    def sidecar(cls, file):
+        """Returns the path of the index file of a pgn"""
+        return f"{file}.wcidx"
+
+    @classmethod
+    def build(cls, fin, size=0, mtime=0):
+        """
+        Indexes a pgn by scanning it.
+
+        :param fin: the pgn file opened in binary mode
+        :param size: the size of the pgn file
+        :param mtime: the modification time of the pgn file in nanoseconds
+        :return: the ``GameIndex``
+        """
+        index = cls(size, mtime)
+        for start, tags in scan_games(fin, cls.TAGS):
+            index.append(start, tags)
+        index.seal(fin.tell())
+        return index
+
+    @classmethod
+    def stream(cls, entries, path, size=0, mtime=0, memory_budget=MEMORY_BUDGET):
+        """
+        Indexes a pgn straight into a sidecar.
+
+        The entries are spilled to temporary files whenever they take more
+        than ``memory_budget`` bytes, so only the distinct header values have
+        to fit in memory. The sidecar is memory-mapped once written.
+
+        :param entries: the (byte offset, {tag name: value}) of each game,
+                        see ``scan_file``
+        :param path: the path of the sidecar
+        :param size: the size of the pgn file
+        :param mtime: the modification time of the pgn file in nanoseconds
+        :param memory_budget: the rough amount of bytes of entries to keep in
+                              memory
+        :return: the ``GameIndex``
+        """
+        index = cls(size, mtime)
+        entry_size = 8 + 4 + 4 * len(cls.TAGS)
+        limit = max(memory_budget // entry_size, 2)
+        count = 0
+        spills = [tempfile.TemporaryFile() for _ in range(3)]
+        try:
+            for start, tags in entries:
+                index.append(start, tags)
+                if len(index) >= limit:
+                    count += index.spill(spills, len(index) - 1)
+            index.seal(size)
+            count += index.spill(spills, len(index))
+            header = index.pack_header(count)
+            write_sidecar(path, header, (*spills, *pack_strings(index.strings)))
+        finally:
+            for spill in spills:
+                spill.close()
+        return cls.load(path, size, mtime)
+
+    @classmethod
+    def open(cls, file, progress=None, memory_budget=MEMORY_BUDGET):
+        """
+        Loads the index of a pgn from its sidecar or rebuilds it.
+
+        The sidecar is rewritten if it is missing or out of date.
+
+        :param file: the path of the pgn
+        :param progress: a function called with the ``ImportProgress`` while
+                         the pgn is scanned
+        :param memory_budget: the rough amount of bytes of entries to keep in
+                              memory while scanning, see ``stream``
+        :return: the ``GameIndex``
+        """
+        stat = os.stat(file)
+        sidecar = cls.sidecar(file)
+        try:
+            return cls.load(sidecar, stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError):
+            pass
+
+        entries = scan_file(file, cls.TAGS, progress)
+        try:
+            return cls.stream(
+                entries, sidecar, stat.st_size, stat.st_mtime_ns, memory_budget
+            )
+        except OSError:
+            if not os.path.isfile(file):
+                raise
+        # The sidecar can't be written, so the index has to stay in memory
+        with open(file, "rb", buffering=CHUNK_SIZE) as fin:
+            return cls.build(fin, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, path, size, mtime):
+        """
+        Memory-maps a sidecar.
+
+        :param path: the path of the sidecar
+        :param size: the current size of the pgn
+        :param mtime: the current modification time of the pgn in nanoseconds
+        :return: the ``GameIndex``
+        :raises ValueError: if the sidecar is invalid or out of date
+        """
+
+        def layout(header):
+            magic, version, ntags, isize, imtime, count, nstrings = header
+            if (magic, version, ntags) != (cls.MAGIC, cls.VERSION, len(cls.TAGS)):
+                raise ValueError("unknown index format")
+            if (isize, imtime) != (size, mtime):
+                raise ValueError("index is out of date")
+            return [("Q", count), ("I", count), ("I", count * ntags)] + [
+                ("Q", nstrings + 1)
+            ]
+
+        mm, header, sections = map_sidecar(path, cls.HEADER, layout)
+        index = cls(size, mtime)
+        index.offsets, index.lengths, index.tags, string_offsets, blob = sections
+        index.strings = StringTable(string_offsets, blob)
+        index.mmap = mm
+        if len(blob) < string_offsets[-1]:
+            index.close()
+            raise ValueError("index is truncated")
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to a sidecar.
+
+        :param path: the path of the sidecar
+        :return: None
+        """
+        strings = pack_strings(self.strings)
+        sections = (self.offsets, self.lengths, self.tags, *strings)
+        write_sidecar(path, self.pack_header(len(self)), sections)
+
+    def pack_header(self, count):
+        """Returns the header of the sidecar of an index of ``count`` games"""
+        return self.HEADER.pack(
+            self.MAGIC,
+            self.VERSION,
+            len(self.TAGS),
+            self.size,
+            self.mtime,
+            count,
+            len(self.strings),
+        )
+
+    def spill(self, files, count):
+        """
+        Moves the first entries of the index to the end of binary files.
+
+        :param files: the files of the offsets, lengths and tags
+        :param count: the amount of entries to move
+        :return: the amount of entries moved
+        """
+        ntags = len(self.TAGS)
+        offsets, lengths, tags = files
+        offsets.write(self.offsets[:count])
+        lengths.write(self.lengths[:count])
+        tags.write(self.tags[: count * ntags])
+        del self.offsets[:count], self.lengths[:count], self.tags[: count * ntags]
+        return count
+
+    def append(self, offset, tags):
+        """
+        Adds a game to the end of the index.
+
+        The length of the previous game is set to end where this one starts.
+
+        :param offset: the byte offset of the game
+        :param tags: the {tag name: value} headers of the game
+        :return: None
+        """
+        self.seal(offset)
+        self.offsets.append(offset)
+        self.lengths.append(0)
+        for name in self.TAGS:
+            self.tags.append(self.intern(tags.get(name, "?")))
+
+    @classmethod
+    def derive(cls, other):
+        """Returns an empty index sharing the string table of another index"""
+        index = cls()
+        index.strings = list(other.strings)
+        index.string_ids = {string: i for i, string in enumerate(index.strings)}
+        return index
+
+    def copy(self, other, start, end, offset):
+        """
+        Adds a run of consecutive games from another index.
+
+        :param other: the ``GameIndex`` to copy from, see ``derive``
+        :param start: the index of the first game in ``other``
+        :param end: the index after the last game in ``other``
+        :param offset: the byte offset of the first game in the new pgn
+        :return: None
+        """
+        self.seal(offset)
+        delta = offset - other.offsets[start]
+        self.offsets.extend(o + delta for o in other.offsets[start:end])
+        self.lengths.frombytes(bytes(other.lengths[start:end]))
+        ntags = len(self.TAGS)
+        self.tags.frombytes(bytes(other.tags[start * ntags : end * ntags]))
+
+    def seal(self, end):
+        """Sets where the last game of the index ends"""
+        if self.offsets:
+            self.lengths[-1] = end - self.offsets[-1]
+
+    def intern(self, string):
+        """Returns the id of a string in the string table"""
+        try:
+            return self.string_ids[string]
+        except KeyError:
+            self.strings.append(string)
+            self.string_ids[string] = len(self.strings) - 1
+            return self.string_ids[string]
+
+    def headers(self, item):
+        """
+        Returns the indexed headers of a game.
+
+        :param item: the index of the game
+        :return: the {tag name: value} headers
+        """
+        ntags = len(self.TAGS)
+        ids = self.tags[item * ntags : (item + 1) * ntags]
+        return {name: self.strings[i] for name, i in zip(self.TAGS, ids)}
+
+    def close(self):
+        """Releases the memory-mapped sidecar"""
+        if self.mmap is not None:
+            for section in (self.offsets, self.lengths, self.tags):
+                section.release()
+            self.strings.offsets.release()
+            self.strings.blob.release()
+            self.mmap.close()
+            self.mmap = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class PackedDatabase:
+    """
+    The native binary database format, saved with the ``.wcdb`` suffix.
+
+    Every game is stored as a ``PackedGame`` with its main headers in a fixed
+    size record of string ids, so games are found, filtered and decoded
+    without parsing any pgn. The file is memory-mapped and can be used in
+    place of a ``GameIndex`` by ``HeaderColumns``.
+
+    Layout of the file (native byte order):
+      * header: magic, version, tags per game, game count, string count,
+        move count, extras size
+      * tags: ``I`` string id per tag per game
+      * move offsets: ``Q`` per game + 1, in moves
+      * extra offsets: ``Q`` per game + 1, in bytes
+      * string offsets: ``Q`` per string + 1
+      * moves: ``H`` per packed move
+      * extras: json of the other headers, comments and nags of each game,
+        empty if there are none
+      * strings: utf-8 blob
+    """
+
+    MAGIC = b"WCDB\x00\x00\x00\x00"
+    VERSION = 1
+    SUFFIX = ".wcdb"
+    TAGS = GameIndex.TAGS
+    HEADER = struct.Struct("=8sIIQQQQ")
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.tags = array("I")
+        self.move_offsets = array("Q", [0])
+        self.extra_offsets = array("Q", [0])
+        self.strings = []
+        self.moves = array("H")
+        self.extras = bytearray()
+        self.mmap = None
+
+    @classmethod
+    def is_packed(cls, file):
+        """Returns if a path is of the native format rather than a pgn"""
+        return str(file).endswith(cls.SUFFIX)
+
+    @classmethod
+    def open(cls, file):
+        """
+        Memory-maps a database file.
+
+        :param file: the path of the file
+        :return: the ``PackedDatabase``
+        :raises ValueError: if the file is invalid
+        """
+
+        def layout(header):
+            magic, version, ntags, count, nstrings, nmoves, nextras = header
+            if (magic, version, ntags) != (cls.MAGIC, cls.VERSION, len(cls.TAGS)):
+                raise ValueError("unknown database format")
+            return [
+                ("I", count * ntags),
+                ("Q", count + 1),
+                ("Q", count + 1),
+                ("Q", nstrings + 1),
+                ("H", nmoves),
+                ("B", nextras),
+            ]
+
+        stat = os.stat(file)
+        mm, header, sections = map_sidecar(file, cls.HEADER, layout)
+        database = cls(stat.st_size, stat.st_mtime_ns)
+        database.tags, database.move_offsets, database.extra_offsets = sections[:3]
+        string_offsets, database.moves, database.extras, blob = sections[3:]
+        database.strings = StringTable(string_offsets, blob)
+        database.mmap = mm
+        if len(blob) < string_offsets[-1]:
+            database.close()
+            raise ValueError("database is truncated")
+        return database
+
+    @classmethod
+    def write(cls, path, games, replace=os.replace):
+        """
+        Writes games to a database file.
+
+        The moves and extras are streamed to temporary files, only the
+        records and the string table are kept in memory.
+
+        :param path: the path of the file
+        :param games: an iterable of ``chess.pgn.Game`` or ``PackedGame``
+        :param replace: the function moving the written file to ``path``, see
+                        ``write_sidecar``
+        :return: None
+        """
+        tags = array("I")
+        move_offsets = array("Q", [0])
+        extra_offsets = array("Q", [0])
+        strings = []
+        string_ids = dict()
+
+        def intern(string):
+            try:
+                return string_ids[string]
+            except KeyError:
+                strings.append(string)
+                string_ids[string] = len(strings) - 1
+                return string_ids[string]
+
+        with tempfile.TemporaryFile() as moves, tempfile.TemporaryFile() as extras:
+            for game in games:
+                game = pack_game(game)
+                headers = dict(game.headers)
+                missing = []
+                for name in cls.TAGS:
+                    value = headers.pop(name, None)
+                    if value is None:
+                        missing.append(name)
+                    tags.append(intern("?" if value is None else value))
+
+                extra = dict()
+                if headers:
+                    extra["headers"] = headers
+                if missing:
+                    extra["missing"] = missing
+                if isinstance(game, PackedGame):
+                    moves.write(game.moves)
+                    for name in ("comments", "starting_comments", "nags"):
+                        if getattr(game, name):
+                            extra[name] = getattr(game, name)
+                    move_offsets.append(move_offsets[-1] + len(game.moves))
+                else:
+                    # Games with drop moves are kept as pgn
+                    extra["pgn"] = str(game)
+                    move_offsets.append(move_offsets[-1])
+                data = json.dumps(extra).encode() if extra else b""
+                extras.write(data)
+                extra_offsets.append(extra_offsets[-1] + len(data))
+
+            header = cls.HEADER.pack(
+                cls.MAGIC,
+                cls.VERSION,
+                len(cls.TAGS),
+                len(move_offsets) - 1,
+                len(strings),
+                move_offsets[-1],
+                extra_offsets[-1],
+            )
+            string_offsets, blob = pack_strings(strings)
+            sections = (tags, move_offsets, extra_offsets, string_offsets)
+            sections = (*sections, moves, extras, blob)
+            write_sidecar(path, header, sections, replace)
+
+    def extra(self, item):
+        """Returns the json extras of a game"""
+        data = self.extras[self.extra_offsets[item] : self.extra_offsets[item + 1]]
+        return json.loads(bytes(data)) if data else dict()
+
+    def headers(self, item):
+        """
+        Returns the main headers of a game, "?" if they are missing.
+
+        :param item: the index of the game
+        :return: the {tag name: value} headers
+        """
+        ntags = len(self.TAGS)
+        ids = self.tags[item * ntags : (item + 1) * ntags]
+        return {name: self.strings[i] for name, i in zip(self.TAGS, ids)}
+
+    def all_headers(self, item, extra=None):
+        """
+        Returns every header of a game.
+
+        :param item: the index of the game
+        :param extra: the extras of the game if they are already decoded
+        :return: the {tag name: value} headers
+        """
+        if extra is None:
+            extra = self.extra(item)
+        headers = self.headers(item)
+        for name in extra.get("missing", ()):
+            del headers[name]
+        headers.update(extra.get("headers", ()))
+        return headers
+
+    def game(self, item):
+        """
+        Decodes a game.
+
+        :param item: the index of the game
+        :return: the ``PackedGame``, or the ``chess.pgn.Game`` if it has drop
+                 moves
+        """
+        extra = self.extra(item)
+        headers = self.all_headers(item, extra)
+        if "pgn" in extra:
+            return chess.pgn.read_game(io.StringIO(extra["pgn"]))
+
+        moves = array("H")
+        start, end = self.move_offsets[item], self.move_offsets[item + 1]
+        moves.frombytes(self.moves[start:end].cast("B"))
+        return PackedGame(
+            headers,
+            moves,
+            {int(k): v for k, v in extra.get("comments", dict()).items()},
+            {int(k): v for k, v in extra.get("starting_comments", dict()).items()},
+            {int(k): tuple(v) for k, v in extra.get("nags", dict()).items()},
+        )
+
+    def close(self):
+        """Releases the memory-mapped file"""
+        if self.mmap is not None:
+            sections = (self.tags, self.move_offsets, self.extra_offsets)
+            for section in (*sections, self.moves, self.extras):
+                section.release()
+            self.strings.offsets.release()
+            self.strings.blob.release()
+            self.mmap.close()
+            self.mmap = None
+
+    def __len__(self):
+        return len(self.move_offsets) - 1
+
+
+def position_hashes(game):
+    """
+    Hashes every position of a game, variations included.
+
+    :param game: the ``chess.pgn.Game``
+    :return: the sorted arrays of the zobrist hashes and the plies they
+             are reached at, without duplicate (hash, ply) pairs
+    """
+    zobrist_hash = chess.polyglot.zobrist_hash
+    positions = set()
+    board = game.board()
+    stack = [(game, 0)]
+    while stack:
+        node, ply = stack.pop()
+        if node is None:
+            board.pop()
+            continue
+        if node is not game:
+            board.push(node.move)
+            stack.append((None, ply))
+        positions.add((zobrist_hash(board), ply))
+        stack.extend((child, ply + 1) for child in reversed(node.variations))
+    positions = sorted(positions)
+    return (
+        array("Q", (h for h, _ in positions)),
+        array("H", (min(ply, 0xFFFF) for _, ply in positions)),
+    )
+
+
+class PositionIndex:
+    """
+    Maps the zobrist hash of every position in a pgn to the games and plies
+    it is reached at.
+
+    The entries are sorted by hash so a lookup is a binary search. Like the
+    ``GameIndex``, it is saved to a memory-mapped sidecar next to the pgn.
+
+    Layout of the sidecar (native byte order):
+      * header: magic, version, pgn size, pgn mtime, entry count
+      * hashes: ``Q`` per entry
+      * games: ``I`` per entry
+      * plies: ``H`` per entry
+    """
+
+    MAGIC = b"WCPOS\x00\x00\x00"
+    VERSION = 1
+    HEADER = struct.Struct("=8sIQqQ")
+    BUCKET_BITS = 10
+
+    def __init__(self, size=0, mtime=0):
+        self.size = size
+        self.mtime = mtime
+        self.hashes = array("Q")
+        self.games = array("I")
+        self.plies = array("H")
+        self.mmap = None
+
+    @classmethod
+    def sidecar(cls, file):
+        """Returns the path of the position index file of a pgn"""
+        return f"{file}.wcpos"
+
+    @classmethod
+    def build(cls, database, workers=None):
+        """
+        Indexes the positions of the games in the file of a database.
+
+        The games are indexed as they are in the file, so that the index
+        stays valid for the file. Edited games are searched separately by
+        ``Database.find_position``.
+
+        :param database: the ``Database``
+        :param workers: the amount of processes used to parse the games
+        :return: the ``PositionIndex``
+        """
+        # Bucket by the top bits of the hash so only one bucket at a time
+        # has to be sorted as python objects
+        buckets = [(array("Q"), array("Q")) for _ in range(1 << cls.BUCKET_BITS)]
+        shift = 64 - cls.BUCKET_BITS
+        results = database.map(position_hashes, workers, edited=dict())
+        for game, (hashes, plies) in enumerate(results):
+            for zobrist_hash, ply in zip(hashes, plies):
+                bucket_hashes, bucket_entries = buckets[zobrist_hash >> shift]
+                bucket_hashes.append(zobrist_hash)
+                bucket_entries.append(game << 16 | ply)
+
+        index = cls(database.index.size, database.index.mtime)
+        for bucket_hashes, bucket_entries in buckets:
+            for zobrist_hash, entry in sorted(zip(bucket_hashes, bucket_entries)):
+                index.hashes.append(zobrist_hash)
+                index.games.append(entry >> 16)
+                index.plies.append(entry & 0xFFFF)
+            del bucket_hashes[:], bucket_entries[:]
+        return index
+
+    @classmethod
+    def open(cls, database, workers=None):
+        """
+        Loads the position index of a database from its sidecar or builds it.
+
+        :param database: the ``Database``
+        :param workers: the amount of processes used to parse the games
+        :return: the ``PositionIndex``
+        """
+        # A database without a file keeps its index in memory
+        if not (database.file and os.path.isfile(database.file)):
+            return cls.build(database, workers)
+
+        size, mtime = database.index.size, database.index.mtime
+        try:
+            return cls.load(cls.sidecar(database.file), size, mtime)
+        except (OSError, ValueError):
+            pass
+
+        index = cls.build(database, workers)
+        try:
+            index.save(cls.sidecar(database.file))
+        except OSError:
+            pass
+        return index
+
+    @classmethod
+    def load(cls, path, size, mtime):
+        """
+        Memory-maps a sidecar.
+
+        :param path: the path of the sidecar
+        :param size: the current size of the pgn
+        :param mtime: the current modification time of the pgn in nanoseconds
+        :return: the ``PositionIndex``
+        :raises ValueError: if the sidecar is invalid or out of date
+        """
+
+        def layout(header):
+            magic, version, isize, imtime, count = header
+            if (magic, version) != (cls.MAGIC, cls.VERSION):
+                raise ValueError("unknown index format")
+            if (isize, imtime) != (size, mtime):
+                raise ValueError("index is out of date")
+            return [("Q", count), ("I", count), ("H", count)]
+
+        mm, header, sections = map_sidecar(path, cls.HEADER, layout)
+        index = cls(size, mtime)
+        index.hashes, index.games, index.plies, rest = sections
+        rest.release()
+        index.mmap = mm
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to a sidecar.
+
+        :param path: the path of the sidecar
+        :return: None
+        """
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, self.size, self.mtime, len(self)
+        )
+        write_sidecar(path, header, (self.hashes, self.games, self.plies))
+
+    def find(self, zobrist_hash):
+        """
+        Looks up a position.
+
+        :param zobrist_hash: the ``chess.polyglot.zobrist_hash`` of the position
+        :return: the list of (game index, ply) where the position is reached
+        """
+        start = bisect.bisect_left(self.hashes, zobrist_hash)
+        end = bisect.bisect_right(self.hashes, zobrist_hash, start)
+        return list(zip(self.games[start:end], self.plies[start:end]))
+
+    def close(self):
+        """Releases the memory-mapped sidecar"""
+        if self.mmap is not None:
+            for section in (self.hashes, self.games, self.plies):
+                section.release()
+            self.mmap.close()
+            self.mmap = None
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def elo(rating):
+    """Converts an Elo header to an int, 0 if it is unknown"""
+    return int(rating) if rating.isdigit() else 0
+
+
+def eco_code(eco):
+    """
+    Converts an ECO header to an int which keeps the order of the codes.
+
+    :param eco: the ECO code, eg. "B90"
+    :return: 100 * the letter + the number, eg. 190, or -1 if it is invalid
+    """
+    if len(eco) == 3 and eco[0] in "ABCDE" and eco[1:].isdigit():
+        return "ABCDE".index(eco[0]) * 100 + int(eco[1:])
+    return -1
+
+
+def result_code(result):
+    """Converts a Result header to ``HeaderColumns.RESULTS``, 0 if unfinished"""
+    return HeaderColumns.RESULTS.get(result, 0)
+
+
+def date_code(date):
+    """
+    Converts a Date header to an int which keeps the order of the dates.
+
+    :param date: the date, eg. "2020.07.??"
+    :return: yyyymmdd with unknown parts as 0, eg. 20200700
+    """
+    code = 0
+    for part, scale in zip(date.split("."), (10000, 100, 1)):
+        if part.isdigit():
+            code += int(part) * scale
+    return code
+
+
+class HeaderColumns:
+    """
+    The indexed headers of every game as numpy columns, for filtering.
+
+    String headers are columns of codes into the string table of the index,
+    which is only decoded for the strings that are used. Numeric headers are
+    converted once per distinct string. Predicates are
+    combined with ``&``, ``|`` and ``~`` and passed to ``Database.query``.
+
+    >>> db.query(
+    ...     lambda c: (c.white_elo > 2600)
+    ...     & (c.result == c.RESULTS["1-0"])
+    ...     & c.eco_between("B90", "B99")
+    ... )
+    """
+
+    RESULTS = {"1-0": 1, "0-1": 2, "1/2-1/2": 3}
+
+    def __init__(self, index, edited=None, length=None):
+        """
+        :param index: the ``GameIndex`` of the pgn
+        :param edited: the {game index: headers} of edited games
+        :param length: the amount of games, defaults to the indexed amount
+        """
+        edited = edited or dict()
+        length = len(index) if length is None else length
+        ntags = len(index.TAGS)
+        self.tags = {tag: i for i, tag in enumerate(index.TAGS)}
+        # The strings of the index, then the ones only edited games have
+        self.table = index.strings
+        self.table_ids = getattr(index, "string_ids", dict())
+        self.added = []
+        self.string_ids = dict()
+        self.columns = dict()
+
+        # Copied so that the memory-mapped index can still be closed
+        codes = np.frombuffer(index.tags, dtype=np.uint32).reshape(-1, ntags)
+        self.codes = np.resize(codes, (length, ntags))
+        for item, headers in edited.items():
+            self.update(item, headers)
+
+    def string(self, code):
+        """Returns the string of a code"""
+        if code < len(self.table):
+            return self.table[code]
+        return self.added[code - len(self.table)]
+
+    def string_id(self, string):
+        """
+        Returns the code of a string.
+
+        :param string: the header value
+        :return: the code, None if no game has the string
+        """
+        try:
+            return self.string_ids[string]
+        except KeyError:
+            pass
+        if isinstance(self.table, StringTable):
+            code = self.table.find(string)
+        else:
+            code = self.table_ids.get(string)
+        if code is not None:
+            self.string_ids[string] = code
+        return code
+
+    def intern(self, string):
+        """Returns the code of a string, adding it if no game has it"""
+        code = self.string_id(string)
+        if code is None:
+            self.added.append(string)
+            code = self.string_ids[string] = len(self.table) + len(self.added) - 1
+        return code
+
+    def update(self, item, headers):
+        """
+        Sets the headers of a game, adding rows if it is a new game.
+
+        :param item: the index of the game
+        :param headers: the {tag name: value} headers of the game
+        :return: None
+        """
+        if item >= len(self.codes):
+            codes = np.zeros((item + 1, len(self.tags)), dtype=np.uint32)
+            codes[: len(self.codes)] = self.codes
+            self.codes = codes
+            self.columns.clear()
+        row = [self.intern(headers.get(tag, "?")) for tag in self.tags]
+        self.codes[item] = row
+        for (tag, convert), column in self.columns.items():
+            column[item] = convert(self.string(row[self.tags[tag]]))
+
+    def column(self, tag):
+        """Returns the string codes of a header"""
+        return self.codes[:, self.tags[tag]]
+
+    def numbers(self, tag, convert):
+        """
+        Returns a header converted to numbers.
+
+        :param tag: the name of the header
+        :param convert: the function converting a header value to an int
+        :return: the numpy array
+        """
+        try:
+            return self.columns[tag, convert]
+        except KeyError:
+            column = self.columns[tag, convert] = self.convert(tag, convert)
+            return column
+
+    def convert(self, tag, convert, dtype=np.int32):
+        """
+        Converts each distinct value of a header, without caching the result.
+
+        :param tag: the name of the header
+        :param convert: the function converting a header value
+        :param dtype: the numpy type of the converted values
+        :return: the numpy array
+        """
+        codes = self.column(tag)
+        distinct = np.unique(codes)
+        table = np.zeros(len(self.table) + len(self.added), dtype=dtype)
+        table[distinct] = [convert(self.string(i)) for i in distinct]
+        return table[codes]
+
+    def where(self, tag, func):
+        """
+        Filters by a header with a python predicate on its distinct values.
+
+        :param tag: the name of the header
+        :param func: the function of a header value returning a bool
+        :return: the boolean mask of the games
+        """
+        return self.convert(tag, func, bool)
+
+    def equals(self, tag, value):
+        """Returns the mask of the games with a header equal to ``value``"""
+        code = self.string_id(value)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self.column(tag) == code
+
+    def isin(self, tag, values):
+        """Returns the mask of the games with a header in ``values``"""
+        ids = [code for code in map(self.string_id, values) if code is not None]
+        return np.isin(self.column(tag), ids)
+
+    def eco_between(self, low, high):
+        """Returns the mask of the games with an ECO code from low to high"""
+        eco = self.eco
+        return (eco_code(low) <= eco) & (eco <= eco_code(high))
+
+    @property
+    def white_elo(self):
+        return self.numbers("WhiteElo", elo)
+
+    @property
+    def black_elo(self):
+        return self.numbers("BlackElo", elo)
+
+    @property
+    def eco(self):
+        return self.numbers("ECO", eco_code)
+
+    @property
+    def date(self):
+        return self.numbers("Date", date_code)
+
+    @property
+    def result(self):
+        return self.numbers("Result", result_code)
+
+    def __len__(self):
+        return len(self.codes)
+
 
 class Database:
-    def __init__(self, file=""):
+    def __init__(
+        self, file="", cache_size=64, progress=None, memory_budget=MEMORY_BUDGET
+    ):
+        """
+        Opens the pgn or ``PackedDatabase`` at ``file``.
+
+        Only the byte offset of each game is read up front, the games
+        themselves are parsed when they are accessed. Only the game last
+        accessed with ``database[item]`` is kept as a ``chess.pgn.Game``, the
+        other games in memory are kept as ``PackedGame``.
+
+        :param file: the path of the pgn
+        :param cache_size: the amount of parsed games to keep in memory
+        :param progress: a function called with the ``ImportProgress`` while
+                         an unindexed pgn is scanned
+        :param memory_budget: the rough amount of bytes of index entries to
+                              keep in memory while scanning
+        """
         self.file = file
-        self.games = []
-        try:
-            with open(file, "r") as fin:
-                game = True
-                while game is not None:
-                    self.games.append(game)
-                    game = chess.pgn.read_game(fin)
-                self.games.pop(0)
+        self.index = GameIndex()
+        self.position_index = None
+        self.header_columns = None
+        self.length = 0
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        # Games which are not in the file or have been changed since loading
+        self.edited = dict()
+        # How many times each edited game was marked, to tell which games
+        # changed while they were being saved
+        self.versions = dict()
+        # The games whose rows of the header columns are out of date
+        self.changed_headers = set()
+        # The (index, chess.pgn.Game) of the game being edited
+        self.active = None
+        # Held while changing the edited games or the index, since saving
+        # runs in another thread
+        self.lock = threading.RLock()
+        # Held for the whole of a save, so saves don't read the file another
+        # save is replacing
+        self.save_lock = threading.Lock()
+        try:
+            if PackedDatabase.is_packed(file):
+                self.index = PackedDatabase.open(file)
+            else:
+                self.index = GameIndex.open(file, progress, memory_budget)
+            self.length = len(self.index)
         except FileNotFoundError:
             self.add()
 
+    @property
+    def packed(self):
+        """Whether the file is a ``PackedDatabase`` rather than a pgn"""
+        return isinstance(self.index, PackedDatabase)
+
     def add(self, item=None):
         if item is None:
             item = chess.pgn.Game()
-        self.games.append(item)
+        with self.lock:
+            self.edited[self.length] = item
+            self.versions[self.length] = 1
+            self.changed_headers.add(self.length)
+            self.length += 1
+
+    def mark_dirty(self, item, game=None):
+        """
+        Marks a game as changed so that it is never dropped from memory.
+
+        :param item: the index of the game
+        :param game: the changed ``chess.pgn.Game``, defaults to ``self[item]``
+        :return: None
+        """
+        if game is None:
+            game = self[item]
+        item = self.__index(item)
+        with self.lock:
+            self.edited[item] = game
+            self.versions[item] = self.versions.get(item, 0) + 1
+            self.changed_headers.add(item)
+            self.cache.pop(item, None)
+
+    @staticmethod
+    def ask_file():
+        """Asks which pgn to open, None if cancelled"""
+        filetypes = ("*.pgn", "*" + PackedDatabase.SUFFIX)
+        return fileopenbox("Which file to open?", "WayChess", filetypes=filetypes)
 
-    def new_file(self):
-        fil = fileopenbox("Which file to open?", "WayChess", filetypes=("pgn",))
-        self.__init__(fil)
+    def new_file(self, progress=None):
+        """
+        Asks for a pgn and opens it in place of the current one.
+
+        :param progress: a function called with the ``ImportProgress`` while
+                         the pgn is scanned
+        :return: None
+        """
+        fil = self.ask_file()
+        if not fil:
+            return
+        self.close()
+        self.__init__(fil, self.cache_size, progress)
 
     def save(self, file=None):
+        """
+        Saves the database as a pgn, or as a ``PackedDatabase`` if ``file``
+        has its suffix.
+
+        When saving a pgn to a pgn, only the games which have been edited are
+        written out again, the rest of the pgn is copied byte for byte from
+        the original file. The new file is written to a temporary file which
+        then replaces ``file``, so the old one stays intact if saving fails
+        midway. Saves made at the same time run one after the other.
+
+        :param file: the path to save to, defaults to the opened file
+        :return: None
+        """
         isfile = os.path.isfile
 
-        if (self.file is None and file is None) or (
-            not isfile(file) and not isfile(self.file)
-        ):
-            file = filesavebox("Save to which file?", "WayChess", filetypes=("pgn",))
+        if file is None:
+            file = self.file
+        if not (file and isfile(file)) and not (self.file and isfile(self.file)):
+            filetypes = ("*.pgn", "*" + PackedDatabase.SUFFIX)
+            file = filesavebox("Save to which file?", "WayChess", filetypes=filetypes)
             self.file = file
-        with open(file, "w+") as fout:
-            for game in self.games:
-                print(game, file=fout, end="\n\n")
+        if not file:
+            return
+
+        with self.save_lock:
+            edited, versions = self.snapshot()
+            if PackedDatabase.is_packed(file):
+                games = self.packed_games(edited=edited)
+                PackedDatabase.write(file, games, self.replace)
+                self.reset(file, edited, versions)
+                return
+
+            directory = os.path.dirname(os.path.abspath(file))
+            handle, temp = tempfile.mkstemp(".pgn", dir=directory)
+            try:
+                with open(handle, "wb") as fout:
+                    index = self.write(fout, edited)
+                copy_mode(file, temp)
+                os.replace(temp, file)
+            except BaseException:
+                os.remove(temp)
+                raise
+
+            stat = os.stat(file)
+            index.size, index.mtime = stat.st_size, stat.st_mtime_ns
+            self.install(index)
+            try:
+                index.save(GameIndex.sidecar(file))
+            except OSError:
+                pass
+            self.reset(file, edited, versions)
+
+    def snapshot(self):
+        """
+        Copies the edited games so that they can be saved while being edited.
+
+        :return: the {game index: packed game} of the edited games and the
+                 {game index: version} of when they were copied
+        """
+        with self.lock:
+            edited = {item: pack_game(game) for item, game in self.edited.items()}
+            return edited, dict(self.versions)
+
+    def install(self, index):
+        """
+        Replaces the index by the one of the saved file.
+
+        :param index: the ``GameIndex`` or ``PackedDatabase`` of the new file
+        :return: None
+        """
+        with self.lock:
+            old, self.index = self.index, index
+            old.close()
+            self.header_columns = None
+            if self.position_index is not None:
+                self.position_index.close()
+                self.position_index = None
+
+    def replace(self, temp, file):
+        """
+        Moves a saved ``PackedDatabase`` to its file and opens it.
+
+        A memory-mapped file can't be replaced on Windows, so the open
+        database is closed first when it is the one being replaced.
+
+        :param temp: the path of the written file
+        :param file: the path to save to
+        :return: None
+        """
+        with self.lock:
+            reopen = self.packed and os.path.isfile(file)
+            reopen = reopen and os.path.samefile(self.file, file)
+            if reopen:
+                self.index.close()
+            try:
+                os.replace(temp, file)
+            except BaseException:
+                if reopen:
+                    self.index = PackedDatabase.open(self.file)
+                raise
+            self.install(PackedDatabase.open(file))
+
+    def reset(self, file, saved, versions):
+        """
+        Makes the saved ``file`` the file of the database.
+
+        The saved games are only forgotten if they weren't changed again while
+        being saved.
+
+        :param file: the path of the saved file
+        :param saved: the {game index: game} which were saved, see ``snapshot``
+        :param versions: the {game index: version} of the saved games
+        :return: None
+        """
+        with self.lock:
+            self.file = file
+            for item, game in saved.items():
+                if self.versions.get(item) == versions.get(item):
+                    self.edited.pop(item, None)
+                    self.versions.pop(item, None)
+                    self.cache_game(item, game)
+
+    def packed_games(self, workers=None, edited=None):
+        """
+        Packs every game of the database, see ``PackedDatabase.write``.
+
+        :param workers: the amount of processes used to parse a pgn
+        :param edited: the {game index: game} to use in place of the games in
+                       the file, defaults to the edited games
+        :return: a generator of the ``PackedGame`` of each game, or the
+                 ``chess.pgn.Game`` of games with drop moves
+        """
+        if edited is None:
+            edited = self.edited
+        if not self.packed:
+            yield from self.map(pack_game, workers, edited=edited)
+            return
+        for item in range(self.edited_length(edited)):
+            if item in edited:
+                yield pack_game(edited[item])
+            else:
+                yield self.index.game(item)
+
+    def edited_length(self, edited):
+        """Returns the amount of games with ``edited`` in place of the file's"""
+        return max(len(self.index), max(edited, default=-1) + 1)
+
+    def write(self, fout, edited=None):
+        """
+        Writes the database as a pgn.
+
+        Runs of unchanged games are copied straight from the opened pgn, if it
+        is one.
+
+        :param fout: the file to write to, opened in binary mode
+        :param edited: the {game index: game} to use in place of the games in
+                       the file, defaults to the edited games
+        :return: the ``GameIndex`` of the written pgn
+        :raises ValueError: if the pgn changed since it was indexed, since the
+                            games can't be copied from it anymore
+        """
+        if edited is None:
+            edited = self.edited
+        length = self.edited_length(edited)
+        index = GameIndex.derive(self.index)
+        tail = b"\n\n"
+
+        def separate():
+            nonlocal tail
+            if not tail.endswith((b"\n\n", b"\n\r\n")):
+                fout.write(b"\n" if tail.endswith(b"\n") else b"\n\n")
+            tail = b"\n\n"
+
+        copy = len(self.index) and not self.packed
+        with open(self.file, "rb") if copy else io.BytesIO() as fin:
+            if copy:
+                stat = os.fstat(fin.fileno())
+                indexed = (self.index.size, self.index.mtime)
+                if (stat.st_size, stat.st_mtime_ns) != indexed:
+                    raise ValueError(f"{self.file} changed since it was opened")
+            item = 0
+            while item < length:
+                if item in edited or not copy:
+                    game = edited[item] if item in edited else self.stored_game(item)
+                    game = unpack_game(game)
+                    separate()
+                    index.append(fout.tell(), game.headers)
+                    data = str(game).encode() + b"\n\n"
+                    fout.write(data)
+                    tail = data[-2:]
+                    item += 1
+                    continue
+
+                # Copy the run of unchanged games starting at item
+                run = item
+                while run < len(self.index) and run not in edited:
+                    run += 1
+                index.copy(self.index, item, run, fout.tell())
+                start = self.index.offsets[item]
+                end = self.index.offsets[run - 1] + self.index.lengths[run - 1]
+                fin.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    data = fin.read(min(remaining, shutil.COPY_BUFSIZE))
+                    if not data:
+                        break
+                    fout.write(data)
+                    remaining -= len(data)
+                    tail = (tail + data)[-3:]
+                item = run
+
+        index.seal(fout.tell())
+        return index
+
+    def positions(self, workers=None):
+        """
+        Returns the index of the positions reached in the games of the pgn.
+
+        It is built the first time it is needed, which parses every game.
+
+        :param workers: the amount of processes used to parse the games
+        :return: the ``PositionIndex``
+        """
+        if self.position_index is None:
+            self.position_index = PositionIndex.open(self, workers)
+        return self.position_index
+
+    def find_position(self, board, workers=None):
+        """
+        Finds every game which reaches a position.
+
+        :param board: the ``chess.Board`` of the position
+        :param workers: the amount of processes used if the position index has
+                        to be built
+        :return: the sorted list of (game index, ply) where it is reached
+        """
+        zobrist_hash = chess.polyglot.zobrist_hash(board)
+        found = [
+            (game, ply)
+            for game, ply in self.positions(workers).find(zobrist_hash)
+            if game not in self.edited
+        ]
+        for item in list(self.edited):
+            hashes, plies = position_hashes(self.load(item))
+            start = bisect.bisect_left(hashes, zobrist_hash)
+            end = bisect.bisect_right(hashes, zobrist_hash, start)
+            found.extend((item, ply) for ply in plies[start:end])
+        return sorted(found)
+
+    def columns(self):
+        """
+        Returns the main headers of every game as numpy columns.
+
+        :return: the ``HeaderColumns``
+        """
+        with self.lock:
+            if self.header_columns is None:
+                edited = {item: game.headers for item, game in self.edited.items()}
+                self.header_columns = HeaderColumns(self.index, edited, len(self))
+            else:
+                for item in self.changed_headers:
+                    game = self.edited[item]
+                    self.header_columns.update(item, game.headers)
+            self.changed_headers.clear()
+            return self.header_columns
+
+    def query(self, predicate):
+        """
+        Filters the games by their headers.
+
+        :param predicate: a function of the ``HeaderColumns`` returning a
+                          boolean mask of the games
+        :return: the numpy array of the indexes of the matching games
+        """
+        with self.lock:
+            return np.flatnonzero(predicate(self.columns()))
+
+    def close(self):
+        """Releases the memory-mapped indexes"""
+        self.index.close()
+        if self.position_index is not None:
+            self.position_index.close()
+            self.position_index = None
+
+    def headers(self, item):
+        """
+        Reads the headers of a game without parsing its moves.
+
+        :param item: the index of the game
+        :return: the {tag name: value} headers
+        """
+        item = self.__index(item)
+        with self.lock:
+            if item in self.edited:
+                return dict(self.edited[item].headers)
+            if self.packed:
+                return self.index.all_headers(item)
+            return read_tags(self.read_bytes(item))
+
+    def iter_headers(self):
+        """
+        Reads the headers of every game in one pass without parsing any moves.
+
+        :return: a generator of the {tag name: value} headers of each game
+        """
+        item = 0
+        if self.packed:
+            for item in range(len(self.index)):
+                yield self.headers(item)
+            item = len(self.index)
+        elif len(self.index):
+            with open(self.file, "rb") as fin:
+                for item, (_, tags) in enumerate(scan_games(fin, None)):
+                    if item in self.edited:
+                        tags = dict(self.edited[item].headers)
+                    yield tags
+                item += 1
+        for item in range(item, len(self)):
+            yield dict(self.edited[item].headers)
+
+    def chunks(self, size, edited=None):
+        """
+        Splits the database into chunks to parse.
+
+        :param size: the rough amount of bytes per chunk, of moves for a
+                     ``PackedDatabase``
+        :param edited: the {game index: game} to use in place of the games in
+                       the file, defaults to the edited games
+        :return: a generator of either (first game, game after last) ranges
+                 of unedited games in the file or the index of an edited game
+        """
+        if edited is None:
+            edited = self.edited
+        offsets = self.index.move_offsets if self.packed else self.index.offsets
+        item = 0
+        length = self.edited_length(edited)
+        while item < length:
+            if item in edited:
+                yield item
+                item += 1
+                continue
+            start = item
+            end = offsets[item] + size
+            while (
+                item < len(self.index)
+                and item not in edited
+                and (item == start or offsets[item] < end)
+            ):
+                item += 1
+            yield start, item
+
+    def map(self, func, workers=None, chunk_size=None, edited=None):
+        """
+        Applies a function to every game, parsing the pgn in parallel.
+
+        The pgn is split into chunks on game boundaries which are parsed in a
+        process pool. ``func`` has to be picklable, eg. a module level
+        function, and should return something smaller than a game, since the
+        results are sent back to this process. Only a couple of chunks per
+        worker are parsed ahead of the results being consumed.
+
+        :param func: the function to apply to each ``chess.pgn.Game``
+        :param workers: the amount of processes, defaults to the cpu count
+        :param chunk_size: the rough amount of bytes per chunk, of moves for a
+                           ``PackedDatabase``, defaults to splitting the file
+                           in 4 chunks per worker
+        :param edited: the {game index: game} to use in place of the games in
+                       the file, defaults to the edited games
+        :return: a generator of the results in the order of the games
+        """
+        if edited is None:
+            edited = self.edited
+        workers = workers or os.cpu_count() or 1
+        if chunk_size is None:
+            if self.packed:
+                moves = self.index.move_offsets[-1]
+                chunk_size = max(moves // (workers * 4), 1 << 13)
+            else:
+                chunk_size = max(self.index.size // (workers * 4), 1 << 16)
+
+        tasks = []
+        for chunk in self.chunks(chunk_size, edited):
+            if isinstance(chunk, int):
+                tasks.append(chunk)
+            elif self.packed:
+                tasks.append((unpack_chunk, self.file, *chunk, func))
+            else:
+                start, end = chunk
+                last = end - 1
+                end_offset = self.index.offsets[last] + self.index.lengths[last]
+                args = (self.index.offsets[start], end_offset, end - start, func)
+                tasks.append((parse_chunk, self.file, *args))
+
+        def results(task):
+            if isinstance(task, int):
+                return [func(unpack_game(edited[task]))]
+            if isinstance(task, tuple):
+                return task[0](*task[1:])
+            return task.result()
+
+        if workers == 1 or all(isinstance(t, int) for t in tasks):
+            for task in tasks:
+                yield from results(task)
+            return
+
+        with ProcessPoolExecutor(workers) as executor:
+            pending = deque()
+            for task in tasks:
+                if not isinstance(task, int):
+                    task = executor.submit(*task)
+                pending.append(task)
+                if len(pending) > 2 * workers:
+                    yield from results(pending.popleft())
+            while pending:
+                yield from results(pending.popleft())
+
+    def export(self, file, workers=None):
+        """
+        Writes every game of the database to a new pgn, as python-chess would
+        print it, or to a new ``PackedDatabase`` if ``file`` has its suffix.
+
+        :param file: the path to write to
+        :param workers: the amount of processes used to parse the games
+        :return: None
+        """
+        if PackedDatabase.is_packed(file):
+            PackedDatabase.write(file, self.packed_games(workers))
+            return
+        with open(file, "w", encoding="utf-8") as fout:
+            for text in self.map(str, workers):
+                print(text, file=fout, end="\n\n")
+
+    def stored_game(self, item):
+        """
+        Reads a game as it is in the file, without keeping it in the cache.
+
+        :param item: the index of the game in the file
+        :return: the ``chess.pgn.Game``
+        """
+        if self.packed:
+            return unpack_game(self.index.game(item))
+        return self.read_game(item)
+
+    def read_game(self, item):
+        """
+        Parses a game straight from the file.
+
+        :param item: the index of the game in the file
+        :return: the ``chess.pgn.Game``
+        """
+        text = self.read_bytes(item).decode("utf-8", errors="replace")
+        return chess.pgn.read_game(io.StringIO(text))
+
+    def read_bytes(self, item):
+        """
+        Reads the text of a game in the file.
+
+        :param item: the index of the game in the file
+        :return: the bytes of the game
+        """
+        with open(self.file, "rb") as fin:
+            fin.seek(self.index.offsets[item])
+            return fin.read(self.index.lengths[item])
+
+    def __index(self, item):
+        length = len(self)
+        if item < 0:
+            item += length
+        if not 0 <= item < length:
+            raise IndexError("database index out of range")
+        return item
 
     def __len__(self):
-        return len(self.games)
+        return self.length
 
     def __iter__(self):
-        return iter(self.games)
+        for i in range(len(self)):
+            yield self.load(i)
 
     def __getitem__(self, item):
-        return self.games[item]
+        """
+        Accesses a game to edit it.
+
+        The game previously accessed this way is packed, so it shouldn't be
+        edited anymore.
+
+        :param item: the index of the game
+        :return: the ``chess.pgn.Game``
+        """
+        item = self.__index(item)
+        with self.lock:
+            if self.active is not None and self.active[0] == item:
+                return self.active[1]
+
+            game = self.load(item)
+            self.deactivate()
+            self.active = (item, game)
+            if item in self.edited:
+                self.edited[item] = game
+            return game
+
+    def load(self, item):
+        """
+        Accesses a game without making it the game being edited.
+
+        :param item: the index of the game
+        :return: the ``chess.pgn.Game``
+        """
+        item = self.__index(item)
+        with self.lock:
+            if self.active is not None and self.active[0] == item:
+                return self.active[1]
+
+            try:
+                game = self.edited[item]
+            except KeyError:
+                try:
+                    self.cache.move_to_end(item)
+                    game = self.cache[item]
+                except KeyError:
+                    if self.packed:
+                        game = self.index.game(item)
+                    else:
+                        game = self.read_game(item)
+                    self.cache_game(item, game)
+        return unpack_game(game)
+
+    def deactivate(self):
+        """Packs the game being edited"""
+        with self.lock:
+            if self.active is None:
+                return
+            item, game = self.active
+            self.active = None
+            if item in self.edited:
+                self.edited[item] = pack_game(game)
+            else:
+                self.cache_game(item, game)
+
+    def cache_game(self, item, game):
+        """
+        Keeps a packed game in the LRU cache.
+
+        :param item: the index of the game
+        :param game: the ``chess.pgn.Game`` or ``PackedGame``
+        :return: None
+        """
+        self.cache[item] = pack_game(game)
+        self.cache.move_to_end(item)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
@@ -21,6 +21,10 @@ import lib
 from core import Database
 
 SQUARE_SIZE = 68
+# Posted to wake up the main loop when something needs to be drawn
+FRAME_EVENT = pygame.USEREVENT + 1
+# Posted by a timer while the ui widgets are animating
+UI_FRAME_EVENT = pygame.USEREVENT + 2
 pwd = Path.home() / ".waychess"
 img = pwd / "img"
 pgn_path = pwd / "test.pgn"
@@ -58,6 +62,11 @@ arrow = lib.arrowlib.arrow
 
 
 class GUI(lib.GUI):
+    # The maximum frames drawn per second, set with --fps=<rate>
+    frame_rate = 120
+    # The frames drawn per second while a ui widget is focused
+    ui_frame_rate = 10
+
     def __init__(self, img, display_size=(800, 600)):
         # Load the images
         self.dark = self.load_img(img / "dark.png")
@@ -87,6 +96,11 @@ class GUI(lib.GUI):
         # Initialize internal variables
         self.SQUARE_SIZE = 68
         self.debug = "--debug" in sys.argv
+        for arg in sys.argv:
+            if arg.startswith("--fps="):
+                self.frame_rate = int(arg[len("--fps=") :])
+            if arg.startswith("--depth="):
+                self.analysis_depth = int(arg[len("--depth=") :])
         self.variation_path = []
         self.piece_at = dict()
         self.database = Database(pgn_path)
@@ -117,6 +131,13 @@ class GUI(lib.GUI):
         self.variation_menu_emphasis = None
 
         self.screen = pygame.display.set_mode(display_size, pygame.RESIZABLE)
+        self.convert_images()
+        self.dirty_rects = None
+        self.frame_requested = False
+        self.ui_timer = False
+        self.drawn_board = None
+        self.drag_layer = None
+        self.drag_rect = None
         self.font = pygame.font.Font(pygame.font.match_font("calibri"), 32)
         self.font_small = pygame.font.Font(pygame.font.match_font("calibri"), 24)
         self.font_engine = pygame.font.Font(pygame.font.match_font("calibri"), 18)
@@ -156,22 +177,22 @@ class GUI(lib.GUI):
 
     @node.setter
     def node(self, value):
-        try:
-            try:
-                position = self._node.variations.index(value)
-                try:
-                    self.variation_path[int(self.move * 2)] = position
-                except IndexError:
-                    self.variation_path.append(position)
-            # Will be raised if value is not a future variation
-            except ValueError:
-                try:
-                    self.variation_path[int(self.move * 2) - 1] = 0
-                except IndexError:
-                    pass
-        # Will be raised if not hasattr(self, "_node")
-        except AttributeError:
+        index = self.tree_index(value)
+        ply, parent, slot, _ = index.entries[value]
+        old = getattr(self, "_node", None)
+        if old is None:
             self.variation_path = [0]
+        elif parent is old:
+            # Going to a variation keeps the choices past it
+            path = self.variation_path
+            path.extend([0] * (ply - len(path)))
+            path[ply - 1] = slot
+        elif old.parent is value:
+            path = self.variation_path
+            if ply < len(path):
+                path[ply] = 0
+        else:
+            self.variation_path = index.path(value) or [0]
         self._node = value
         self.changed_hist = True
         self.stdout("changed game node")
@@ -195,11 +216,50 @@ class GUI(lib.GUI):
         self.stdout("[DISPLAY SIZE SET]", value)
         self._display_size = value
         self.screen = pygame.display.set_mode(value, pygame.RESIZABLE)
+        self.convert_images()
         self.background()
 
-    def blit(self, data, coords):
+    def blit(self, data, coords, area=None):
         newdata, newcoords = map(GUI.coords.scale, (data, coords))
-        self.screen.blit(newdata, newcoords)
+        if area is not None:
+            area = GUI.coords.scale(area)
+        rect = self.screen.blit(newdata, newcoords, area)
+        self.invalidate(rect)
+        return rect
+
+    def invalidate(self, *rects):
+        """
+        Marks parts of the screen as changed so the next refresh shows them.
+
+        :param rects: the changed ``pygame.Rect``
+        :return: None
+        """
+        dirty = self.dirty_rects
+        if dirty is not None:
+            dirty.extend(rects)
+        self.request_frame()
+
+    def invalidate_all(self):
+        """Marks the whole screen as changed"""
+        self.dirty_rects = None
+        self.request_frame()
+
+    def request_frame(self):
+        """
+        Asks the main loop to draw a frame.
+
+        This may be called from any thread, the main loop is woken up once
+        until the frame is drawn.
+        """
+        if not self.frame_requested:
+            self.frame_requested = True
+            pygame.event.post(pygame.event.Event(FRAME_EVENT))
+
+    def invalidate_polygon(self, points):
+        """Marks the bounding box of a polygon drawn on the screen as changed"""
+        xs, ys = zip(*points)
+        left, top = min(xs), min(ys)
+        self.invalidate(pygame.Rect(left, top, max(xs) - left + 1, max(ys) - top + 1))
 
     def stdout(self, *args, **kwargs):
         if self.debug:
@@ -223,6 +283,9 @@ class GUI(lib.GUI):
 
     def background(self, **kwargs):
         self.screen.fill((21, 21, 21))
+        self.invalidate_all()
+        self.drawn_board = None
+        self.drag_layer = None
         self.blurred = False
         self.display_variation_menu = False
         if not self.is_promoting:
@@ -231,23 +294,77 @@ class GUI(lib.GUI):
     def blur(self):
         if not self.blurred:
             BS = self.SQUARE_SIZE * 8
-            pygame.gfxdraw.filled_polygon(
-                self.screen, ((0, 0), (0, BS), (BS, BS), (BS, 0)), (255, 255, 255, 100),
-            )
+            points = ((0, 0), (0, BS), (BS, BS), (BS, 0))
+            pygame.gfxdraw.filled_polygon(self.screen, points, (255, 255, 255, 100))
+            self.invalidate_polygon(points)
+            self.drawn_board = None
             self.blurred = True
 
     @staticmethod
     def load_img(path):
         return pygame.image.load(str(path))
 
+    def convert_images(self):
+        """Converts the loaded images to the pixel format of the display"""
+        for name in ("dark", "light", "promo_back", "promo_high", "check"):
+            setattr(self, name, getattr(self, name).convert_alpha())
+        self.piece_to_img = {
+            piece: image.convert_alpha() for piece, image in self.piece_to_img.items()
+        }
+
     def dark_mode(self):
         """Fills the screen with #151515 color"""
         self.screen.fill((21, 21, 21))
+        self.invalidate_all()
+
+    def draw_frame(self, time_delta):
+        """
+        Draws the ui widgets and updates the changed parts of the display.
+
+        :param time_delta: the seconds since the last frame
+        :return: None
+        """
+        # Keep the ui widgets from requesting another frame while drawing
+        self.frame_requested = True
+        try:
+            with self.profiler.phase("ui update"):
+                self.manager.update(time_delta)
+            with self.profiler.phase("ui draw"):
+                self.draw_ui()
+            self.draw_profile()
+        finally:
+            # Otherwise no other thread could request a frame anymore
+            self.frame_requested = False
+        self.refresh()
+        self.profiler.end_frame()
+
+    def set_ui_timer(self, active):
+        """
+        Starts or stops the timer which draws frames for ui animations.
+
+        :param active: whether the timer should be running
+        :return: None
+        """
+        if active != self.ui_timer:
+            self.ui_timer = active
+            delay = 1000 // self.ui_frame_rate if active else 0
+            pygame.time.set_timer(UI_FRAME_EVENT, delay)
+
+    def on_ui(self, pos):
+        """Returns whether a visible ui widget is at the raw coordinates"""
+        return any(
+            sprite.visible and sprite.rect.collidepoint(pos)
+            for sprite in self.manager.get_sprite_group()
+        )
 
     def refresh(self):
-        with self.display_lock:
-            pygame.display.update()
-        self.fps_monitor.increment()
+        """Updates the parts of the display which changed since the last refresh"""
+        with self.profiler.phase("flip"), self.display_lock:
+            rects, self.dirty_rects = self.dirty_rects, []
+            if rects is None:
+                pygame.display.update()
+            elif rects:
+                pygame.display.update(rects)
 
     def clear_variation(self):
         self.moves_popped = []
@@ -275,7 +392,7 @@ class GUI(lib.GUI):
             end = 8 if self.board.turn else 1
             file = "abcdefgh"[idx]
             self.stdout("Trying", f"{file}{end}={choice}")
-            move = self.board.push_san(f"{file}{end}={choice}")
+            move = self.board.copy().push_san(f"{file}{end}={choice}")
             self.make_move(move)
             self.is_promoting = False
             self.set_board()
@@ -301,6 +418,7 @@ class GUI(lib.GUI):
 
         if button == 1:
             self.stdout("BUTTON 1 RELEASE", self.engine_box_lock.locked())
+            self.drag_layer = None
             self.set_board()
             if self.engine_box_lock.locked():
                 self.engine_box_lock.release()
@@ -333,9 +451,14 @@ class GUI(lib.GUI):
         elif self.button_pressed[1]:
             piece = self.piece_at.get(self.beg_click, None)
             if piece is not None:
-                self.background(set_arrows=False)
-                self.draw_square(*self.beg_click)
-                self.set_arrows()
+                layer = self.drag_layer
+                if layer is None:
+                    layer = self.create_drag_layer()
+                elif self.drag_rect is not None:
+                    # Erase the piece where it was last drawn
+                    rect = self.drag_rect
+                    self.invalidate(self.screen.blit(layer, rect, rect))
+                    self.drag_rect = None
 
                 piece_coords = (
                     coords[0] - SQUARE_SIZE // 2,
@@ -344,14 +467,33 @@ class GUI(lib.GUI):
                 bot = -SQUARE_SIZE
                 up = SQUARE_SIZE * 8
                 if all(bot <= val <= up for val in coords):
-                    self.blit(self.piece_to_img[piece], piece_coords)
+                    self.drag_rect = self.blit(self.piece_to_img[piece], piece_coords)
 
         elif self.button_pressed[3]:
             self.background()
             self.draw_raw_arrow(self.beg_raw_click, coords)
+            self.drawn_board = None
 
         self.textlib_process_mouse_over(event.pos)
 
+    def create_drag_layer(self):
+        """
+        Draws and keeps the screen without the piece being dragged.
+
+        Each frame of the drag then only has to erase the piece from where it
+        was and draw it where it is.
+
+        :return: the ``pygame.Surface`` of the screen
+        """
+        self.background(set_arrows=False)
+        self.draw_square(*self.beg_click)
+        self.set_arrows()
+        self.drawn_board = None
+        with self.display_lock:
+            self.drag_layer = self.screen.copy()
+        self.drag_rect = None
+        return self.drag_layer
+
     def create_game(self):
         """The callback for creating a game"""
         self.database.add()
@@ -372,17 +514,56 @@ class GUI(lib.GUI):
         self.background()
 
     def load_pgn_task(self):
-        self.database.new_file()
+        fil = Database.ask_file()
+        if not fil:
+            return
+        self.render_lines(["Opening the database..."])
+        # The current database stays usable until the new one is indexed
+        database = Database(fil, self.database.cache_size, self.import_progress)
+        old, self.database = self.database, database
+        old.close()
         self.node = self.database[0]
         self.game = 0
         self.background()
 
+    def import_progress(self, progress):
+        """
+        Shows how far the import of a pgn is.
+
+        :param progress: the ``core.ImportProgress``
+        :return: None
+        """
+        mb = 1 << 20
+        self.render_lines(
+            [
+                "Importing the database...",
+                f"{progress.fraction:.0%} of {progress.size / mb:.1f} MB",
+                f"{progress.games} games",
+                f"{progress.bytes_per_second / mb:.1f} MB/s",
+                f"{progress.games_per_second:.0f} games/s",
+            ]
+        )
+
     def load_pgn(self):
         self.t_manager.submit(Thread(target=self.load_pgn_task))
 
     def save_pgn(self):
         self.t_manager.submit(Thread(target=self.database.save))
 
+    def search_position_task(self):
+        self.render_lines(["Searching the database..."])
+        found = self.database.find_position(self.board)
+        lines = [f"{len(found)} positions found"]
+        for game, ply in found[:23]:
+            headers = self.database.headers(game)
+            white, black = headers.get("White", "?"), headers.get("Black", "?")
+            lines.append(f"#{game + 1} {white[:12]} - {black[:12]} (ply {ply})")
+        self.render_lines(lines)
+
+    def search_position(self):
+        """The callback for listing the games which reach the position"""
+        self.t_manager.submit(Thread(target=self.search_position_task))
+
     def key_press(self, event):
         """
         The callback for a key press.
@@ -405,6 +586,8 @@ class GUI(lib.GUI):
             self.key_pressed_dispatch = {
                 276: self.move_back,  #                left arrow key
                 275: self.move_forward,  #             right arrow key
+                278: self.go_to_start,  #              home
+                279: self.go_to_end,  #                end
                 102: self.flip,  #                     f
                 115: self.save_pgn,  #                 s
                 -110: self.create_game,  #             ctrl n
@@ -414,6 +597,8 @@ class GUI(lib.GUI):
                 -101: self.configure_engine_options,  # ctrl e
                 111: self.load_pgn,  #                 o
                 120: self.explorer,  #                 x
+                112: self.search_position,  #          p
+                100: self.toggle_profile,  #           d
                 27: self.background,  #                 <esc>
                 113: self.exit,  #                     q
             }
@@ -446,9 +631,16 @@ class GUI(lib.GUI):
             self.engine.quit()
         except BaseException:
             pass
+        try:
+            self._analysis_store.close()
+        except AttributeError:
+            pass
         sys.exit()
 
     def click(self, event):
+        if event.button in (4, 5):
+            self.textlib_process_mouse_wheel(event.pos, 3 if event.button == 5 else -3)
+            return
         self.button_pressed[event.button] = True
         received = self.receive_coords(*event.pos)
         if event.button == 1:
@@ -485,38 +677,48 @@ class GUI(lib.GUI):
         func(e)
 
     def __call__(self):
-        """The main event loop"""
+        """
+        The main event loop.
+
+        The loop sleeps until an event arrives, handles every queued event and
+        then draws a frame only if something requested one. Frames are drawn
+        at most ``self.frame_rate`` times a second.
+        """
         clock = pygame.time.Clock()
         while True:
-            # Higher than my refresh rate to allow for quicker processing
-            time_delta = clock.tick(288) / 1000.0
-            try:
-                if self.button_pressed[1] or self.onui:
-                    for event in pygame.event.get():
-                        if event.type != 4:
-                            self.stdout(repr(event))
-                        self.update_ui(event)
-                else:
-                    event = pygame.event.wait()
+            self.set_ui_timer(self.onui)
+            # Queued actions run on the next pass without waiting for events
+            events = [] if self.action_execute else [pygame.event.wait()]
+            events.extend(pygame.event.get())
+            for event in events:
+                if event.type == FRAME_EVENT:
+                    continue
+                if event.type == UI_FRAME_EVENT:
+                    self.request_frame()
+                    continue
+                try:
                     if event.type != 4:
                         self.stdout(repr(event))
+                        self.request_frame()
+                    elif self.on_ui(event.pos):
+                        self.request_frame()
+                    with self.profiler.phase("events"):
+                        self.update_ui(event)
 
-                    self.update_ui(event)
-
-            except (
-                AssertionError,
-                AttributeError,
-                KeyError,
-                IndexError,
-                TypeError,
-                ValueError,
-            ) as e:
-                self.stdout(type(e), e)
-                self.print_tb(e)
-            except Exception as e:
-                self.stderr("General", type(e), e)
-                self.print_tb(e)
-                self.exit()
+                except (
+                    AssertionError,
+                    AttributeError,
+                    KeyError,
+                    IndexError,
+                    TypeError,
+                    ValueError,
+                ) as e:
+                    self.stdout(type(e), e)
+                    self.print_tb(e)
+                except Exception as e:
+                    self.stderr("General", type(e), e)
+                    self.print_tb(e)
+                    self.exit()
 
             while self.action_execute:
                 try:
@@ -527,10 +729,10 @@ class GUI(lib.GUI):
             self.action_execute[:] = self.action_queue[:]
             self.action_queue[:] = []
 
+            if not self.frame_requested:
+                continue
             try:
-                self.manager.update(time_delta)
-                self.manager.draw_ui(self.screen)
-                self.refresh()
+                self.draw_frame(clock.tick(self.frame_rate) / 1000.0)
             except Exception as e:
                 self.stderr("[UI]", type(e), e)
                 self.print_tb(e)
@@ -1,6 +1,6 @@
 from . import arrowlib, baselib, boardlib
 from . import chesscomexplorerlib as ccelib
-from . import coordlib, enginelib, fpslib, movelib, textlib, threadlib, uilib
+from . import coordlib, enginelib, fpslib, movelib, textlib, threadlib, treelib, uilib
 
 
 # Combine all the lib gui method definitions
@@ -15,6 +15,7 @@ class GUI(
     movelib.GUI,
     textlib.GUI,
     threadlib.GUI,
+    treelib.GUI,
     uilib.GUI,
 ):
     pass
@@ -1,12 +1,27 @@
+import ast
+import itertools
 import math
 import re
 import sys
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
 
 import pygame
 import pygame.gfxdraw
 
 from . import baselib as bs
 
+# The arrow colors of the [%cal] comment command
+CAL_COLORS = {
+    "G": (0, 255, 0, 150),
+    "R": (255, 0, 0, 150),
+    "Y": (255, 143, 0, 150),
+    "B": (0, 0, 255, 150),
+}
+CAL_LETTERS = {color[:3]: letter for letter, color in CAL_COLORS.items()}
+CAL_RE = re.compile(r"\s*\[%cal\s+([^\]]*)\]")
+CAL_ARROW_RE = re.compile(r"([GRYB])([a-h][1-8])([a-h][1-8])")
+
 
 def get_line_points(sx, sy, ex, ey, thickness):
     cos = math.cos
@@ -52,11 +67,109 @@ def get_line_points(sx, sy, ex, ey, thickness):
 def arrow(screen, lcolor, tricolor, start, end, trirad, thickness=2):
     """
     Draws an antialiased arrow
+
+    :return: the points of the arrow polygon
     """
     points, c, s = get_line_points(*start, *end, thickness)
 
     pygame.gfxdraw.filled_polygon(screen, points, lcolor)
     pygame.gfxdraw.aapolygon(screen, points, lcolor)
+    return points
+
+
+def square_coords(name, white=True):
+    """
+    Converts a square name to the board coordinates.
+
+    :param name: the square name such as "e4"
+    :param white: whether the board is seen from white's side
+    :return: the (x, y) coordinates
+    """
+    file, rank = ord(name[0]) - ord("a"), int(name[1]) - 1
+    if white:
+        return file, 7 - rank
+    return 7 - file, rank
+
+
+def square_name(coords, white=True):
+    """Inverse of square_coords(name, white)"""
+    x, y = coords
+    if white:
+        file, rank = x, 7 - y
+    else:
+        file, rank = 7 - x, y
+    return "abcdefgh"[file] + str(rank + 1)
+
+
+def parse_arrows(comment, white=True, mac=False):
+    """
+    Parses the arrows of a comment.
+
+    Both [%cal] commands and the older "Arrows: " suffix are read.
+
+    :param comment: the comment of the node
+    :param white: whether the board is seen from white's side
+    :param mac: whether to drop the alpha of the [%cal] colors
+    :return: the frozenset of ``Arrow``
+    """
+    arrows = set()
+    for command in CAL_RE.findall(comment):
+        for beg, end, color in cal_arrows(command, white):
+            arrows.add(Arrow(beg, end, color[: 3 if mac else 4]))
+    if "Arrows: " in comment:
+        arrows.update(Arrow.set_from_str(comment))
+    arrows.discard(None)
+    return frozenset(arrows)
+
+
+def cal_arrows(command, white=True):
+    """
+    Yields the arrows of the argument of a [%cal] command.
+
+    :param command: the argument such as "Ge2e4,Rd7d5"
+    :param white: whether the board is seen from white's side
+    :return: the generator of (beg, end, color) tuples
+    """
+    for token in command.split(","):
+        match = CAL_ARROW_RE.fullmatch(token.strip())
+        if match is not None:
+            letter, beg, end = match.groups()
+            beg, end = square_coords(beg, white), square_coords(end, white)
+            yield beg, end, CAL_COLORS[letter]
+
+
+def write_arrows(comment, arrows, white=True):
+    """
+    Returns the comment with its arrows replaced.
+
+    Arrows between squares with a [%cal] color are written as a [%cal]
+    command, the others in the older "Arrows: " suffix.
+
+    :param comment: the comment of the node
+    :param arrows: the iterable of ``Arrow``
+    :param white: whether the board is seen from white's side
+    :return: the new comment
+    """
+    comment = CAL_RE.sub("", comment)
+    if "Arrows: " in comment:
+        comment = comment[: comment.rfind("Arrows: ")]
+    comment = comment.strip()
+
+    cal, other = [], []
+    for arrow in arrows:
+        letter = CAL_LETTERS.get(tuple(arrow.color[:3]))
+        on_board = all(0 <= val <= 7 for val in [*arrow.beg, *arrow.end])
+        if letter is not None and on_board:
+            beg, end = square_name(arrow.beg, white), square_name(arrow.end, white)
+            cal.append(letter + beg + end)
+        else:
+            other.append(arrow)
+
+    if cal:
+        comment = f"[%cal {','.join(sorted(cal))}] {comment}".rstrip()
+    if other:
+        comment += " " * bool(comment) + "Arrows: " + " ".join(map(str, other))
+    return comment
 
 
 class Arrow:
@@ -69,7 +182,7 @@ class Arrow:
     def one_from_str(cls, string):
         matches = re.findall(r"\([^\(\)]+\)", string[6:-1])
         try:
-            return cls(*map(eval, matches))
+            return cls(*map(ast.literal_eval, matches))
         except:
             return None
 
@@ -97,6 +210,8 @@ class Arrow:
 
 
 class GUI:
+    arrow_cache_size = 1024
+
     @property
     def is_mac(self):
         try:
@@ -107,7 +222,35 @@ class GUI:
 
     @property
     def arrows(self):
-        return Arrow.set_from_str(self.node.comment)
+        """
+        The frozenset of arrows at the current node.
+
+        The comment of a node is only parsed again after it changes.
+        """
+        return self.node_arrows(self.node)
+
+    def node_arrows(self, node):
+        """
+        Returns the arrows of a node, parsing its comment once.
+
+        :param node: the ``chess.pgn.GameNode``
+        :return: the frozenset of ``Arrow``
+        """
+        try:
+            annotations = self.arrow_annotations
+        except AttributeError:
+            annotations = self.arrow_annotations = WeakKeyDictionary()
+
+        comment = node.comment
+        try:
+            old_comment, white, arrows = annotations[node]
+            if old_comment == comment and white == self.white:
+                return arrows
+        except KeyError:
+            pass
+        arrows = parse_arrows(comment, self.white, self.is_mac)
+        annotations[node] = (comment, self.white, arrows)
+        return arrows
 
     @property
     def move_arrow_color(self):
@@ -122,25 +265,18 @@ class GUI:
         return (255, 143, 0, 150)[: 3 if self.is_mac else 4]
 
     def write_arrows(self, arrows):
-        if "Arrows: " not in self.node.comment:
-            start = len(self.node.comment)
-        else:
-            start = self.node.comment.rfind("Arrows: ")
-        self.node.comment = (
-            self.node.comment[:start] + "Arrows: " + " ".join(map(str, arrows))
-        )
+        self.node.comment = write_arrows(self.node.comment, arrows, self.white)
+        self.mark_game_dirty()
 
     def add_arrow(self, arrow):
         arrows = self.arrows
         assert arrow not in arrows, "Shouldn't be calling add_arrow"
-        arrows.add(arrow)
-        self.write_arrows(arrows)
+        self.write_arrows(arrows | {arrow})
 
     def remove_arrow(self, arrow):
         arrows = self.arrows
-        assert arrow in self.arrows, "Shouldn't be calling remove_arrow"
-        arrows.remove(arrow)
-        self.write_arrows(arrows)
+        assert arrow in arrows, "Shouldn't be calling remove_arrow"
+        self.write_arrows(arrows - {arrow})
 
     def draw_raw_arrow(self, start, end, color=None):
         """
@@ -155,7 +291,42 @@ class GUI:
         if all(0 <= val <= SQ * 8 for val in [*start, *end]):
             if color is None:
                 color = self.arrow_color
-            arrow(self.screen, color, color, start, end, at, at)
+            points, rect = self.arrow_points(tuple(start), tuple(end), at)
+            pygame.gfxdraw.filled_polygon(self.screen, points, color)
+            pygame.gfxdraw.aapolygon(self.screen, points, color)
+            self.invalidate(pygame.Rect(rect))
+
+    def arrow_points(self, start, end, thickness):
+        """
+        Returns the polygon of an arrow and its bounding rectangle.
+
+        The polygons are kept in an LRU cache, the arrows between square
+        centers are the same on every redraw.
+
+        :param start: the raw coordinates of the beginning of the arrow
+        :param end: the raw coordinates of the end of the arrow
+        :param thickness: the thickness of the arrow
+        :return: the tuple of the points and the (left, top, width, height)
+        """
+        key = (start, end, thickness)
+        try:
+            cache = self.arrow_cache
+        except AttributeError:
+            cache = self.arrow_cache = OrderedDict()
+
+        try:
+            cache.move_to_end(key)
+            return cache[key]
+        except KeyError:
+            pass
+        points = get_line_points(*start, *end, thickness)[0]
+        xs, ys = zip(*points)
+        left, top = min(xs), min(ys)
+        rect = (left, top, max(xs) - left + 1, max(ys) - top + 1)
+        cache[key] = points, rect
+        while len(cache) > self.arrow_cache_size:
+            cache.popitem(last=False)
+        return points, rect
 
     def draw_arrow(self, start, end):
         """
@@ -175,17 +346,29 @@ class GUI:
         # print(self.arrows[self.move])
         self.set_arrows(True)
 
+    def arrow_squares(self):
+        """Returns the (x, y) squares under the arrows and the move arrow"""
+        ends = [(arrow.beg, arrow.end) for arrow in self.arrows]
+        if self.move_arrow is not None:
+            ends.append(tuple(self.receive_coords(*c) for c in self.move_arrow))
+        squares = set()
+        for (bx, by), (ex, ey) in ends:
+            xs = range(min(bx, ex), max(bx, ex) + 1)
+            ys = range(min(by, ey), max(by, ey) + 1)
+            squares.update(itertools.product(xs, ys))
+        return squares
+
     def set_arrows(self, drawing=False):
         """Render all arrows"""
         SQUARE_SIZE = bs.GUI.coords["square size"]
-        arrows = self.arrows
-        for arrow in arrows:
-            start = arrow.beg
-            end = arrow.end
-            s = tuple(i + SQUARE_SIZE // 2 for i in self.get_coords(*start))
-            e = tuple(i + SQUARE_SIZE // 2 for i in self.get_coords(*end))
-            self.draw_raw_arrow(s, e, arrow.color)
-        if self.move_arrow is not None:
-            self.draw_raw_arrow(*self.move_arrow, self.move_arrow_color)
+        with self.profiler.phase("arrows"):
+            for arrow in self.arrows:
+                start = arrow.beg
+                end = arrow.end
+                s = tuple(i + SQUARE_SIZE // 2 for i in self.get_coords(*start))
+                e = tuple(i + SQUARE_SIZE // 2 for i in self.get_coords(*end))
+                self.draw_raw_arrow(s, e, arrow.color)
+            if self.move_arrow is not None:
+                self.draw_raw_arrow(*self.move_arrow, self.move_arrow_color)
         if not drawing:
             self.update_explorer()
@@ -1,3 +1,7 @@
+from weakref import WeakKeyDictionary
+
+import pygame
+
 from . import baselib as bs
 
 
@@ -9,9 +13,39 @@ class GUI:
         """
         Board is a virtual property.
 
-        This accesses the board at the current node
+        This accesses the board at the current node, which is shared so it
+        must be copied before being changed
+        """
+        return self.board_at(self.node)
+
+    def board_at(self, node):
         """
-        return self.node.board()
+        Returns the cached board at a node.
+
+        Missing boards are derived from the closest cached ancestor by
+        pushing the moves in between instead of replaying from the root.
+
+        :param node: the ``chess.pgn.GameNode``
+        :return: the ``chess.Board``, which must not be changed
+        """
+        try:
+            boards = self.boards
+        except AttributeError:
+            boards = self.boards = WeakKeyDictionary()
+
+        path = []
+        board = boards.get(node)
+        while board is None and node.parent is not None:
+            path.append(node)
+            node = node.parent
+            board = boards.get(node)
+        if board is None:
+            board = boards[node] = node.board()
+        for node in reversed(path):
+            board = board.copy()
+            board.push(node.move)
+            boards[node] = board
+        return board
 
     @property
     def fen(self):
@@ -23,6 +57,10 @@ class GUI:
     def set_board(self, set_arrows=True):
         """
         Draws the board at the current node, renders history, and draws arrows
+
+        Only the squares which changed since the board was last drawn are
+        redrawn, the whole board is redrawn when ``self.drawn_board`` was
+        cleared because something else was drawn over it.
         """
         if self.is_promoting:
             return
@@ -34,15 +72,38 @@ class GUI:
             self.move_arrow = ((bx + d, by + d), (ex + d, ey + d))
         except AttributeError:
             self.move_arrow = None
-        self.draw_board()
-        self.piece_at = dict()
         self.is_promoting = False
-        piece_map = self.board.piece_map()
-        to_square, draw_piece = self.to_square, self.draw_piece
-        for i, p in piece_map.items():
-            rank, file = to_square(i)
-            piece = p.symbol()
-            draw_piece(piece, (rank, file))
+
+        to_square = self.to_square
+        pieces = {to_square(i): p.symbol() for i, p in self.board.piece_map().items()}
+        is_checked = self.is_checked
+        checked = frozenset(
+            pos for pos, p in pieces.items() if p in "kK" and is_checked(p)
+        )
+        covered = self.arrow_squares() if set_arrows else set()
+        draw_piece, draw_square = self.draw_piece, self.draw_square
+        with self.profiler.phase("board"):
+            try:
+                old_pieces, old_checked, old_covered = self.drawn_board
+            except (AttributeError, TypeError):
+                self.draw_board(checked)
+                for pos, piece in pieces.items():
+                    draw_piece(piece, pos, clear=False)
+            else:
+                self.drawn_checked = checked
+                changed = {
+                    pos
+                    for pos in old_pieces.keys() | pieces.keys()
+                    if old_pieces.get(pos) != pieces.get(pos)
+                }
+                changed |= old_checked ^ checked | old_covered | covered
+                for pos in changed:
+                    if pos in pieces:
+                        draw_piece(pieces[pos], pos)
+                    else:
+                        draw_square(*pos)
+            self.piece_at = pieces
+            self.drawn_board = (pieces, checked, covered)
         self.right_panel()
         if set_arrows:
             self.set_arrows()
@@ -86,22 +147,67 @@ class GUI:
         SQUARE_SIZE = bs.GUI.coords["square size"]
         return (x // SQUARE_SIZE, y // SQUARE_SIZE)
 
+    def board_background(self, checked=frozenset()):
+        """
+        Returns the empty board as a single surface.
+
+        The surfaces are cached until the square size or the square images
+        change. The board looks the same in both orientations, only the
+        squares of kings in check differ.
+
+        :param checked: the (x, y) squares to highlight as in check
+        :return: the ``pygame.Surface``
+        """
+        SQUARE_SIZE = bs.GUI.coords["square size"]
+        key = (SQUARE_SIZE, self.light, self.dark, self.check)
+        try:
+            if self.background_key != key:
+                raise AttributeError
+            backgrounds = self.backgrounds
+        except AttributeError:
+            self.background_key = key
+            backgrounds = self.backgrounds = dict()
+
+        try:
+            return backgrounds[checked]
+        except KeyError:
+            pass
+        try:
+            surface = backgrounds[frozenset()].copy()
+        except KeyError:
+            surface = pygame.Surface((SQUARE_SIZE * 8, SQUARE_SIZE * 8))
+            for x in range(8):
+                for y in range(8):
+                    image = self.dark if (x + y) % 2 else self.light
+                    surface.blit(image, self.get_coords(x, y))
+        for position in checked:
+            surface.blit(self.check, self.get_coords(*position))
+        backgrounds[checked] = surface
+        return surface
+
     def draw_square(self, x, y):
         """Draws the square at the position"""
+        SQUARE_SIZE = bs.GUI.coords["square size"]
         coords = self.get_coords(x, y)
-        # self.piece_at[(x, y)] = None
+        try:
+            checked = self.drawn_checked
+        except AttributeError:
+            checked = frozenset()
+        background = self.board_background(checked)
 
         with self.display_lock:
-            if (x + y) % 2:
-                self.blit(self.dark, coords)
-            else:
-                self.blit(self.light, coords)
+            self.blit(background, coords, (*coords, SQUARE_SIZE, SQUARE_SIZE))
 
-    def draw_board(self):
-        """Draws the empty board"""
-        for x in range(8):
-            for y in range(8):
-                self.draw_square(x, y)
+    def draw_board(self, checked=frozenset()):
+        """
+        Draws the empty board
+
+        :param checked: the (x, y) squares to highlight as in check
+        :return: None
+        """
+        self.drawn_checked = checked
+        with self.display_lock:
+            self.blit(self.board_background(checked), (0, 0))
 
     def is_checked(self, piece):
         """Returns if the k is in check"""
@@ -109,5 +215,9 @@ class GUI:
 
     def draw_checked(self):
         """Highlights each king in check"""
-        self.draw_piece("k", self.whereis("k"))
-        self.draw_piece("K", self.whereis("K"))
+        kings = {piece: self.whereis(piece) for piece in "kK"}
+        self.drawn_checked = frozenset(
+            position for piece, position in kings.items() if self.is_checked(piece)
+        )
+        for piece, position in kings.items():
+            self.draw_piece(piece, position)
@@ -27,11 +27,9 @@ class Continuation:
             int(length * p) for p in (self.white_f, self.draw_f, self.black_f)
         )
         gui.render_raw_text(self.forward, start_coords, gui.font_xs, (234, 234, 234))
-        gfx.filled_polygon(
-            gui.screen,
-            [(sx, sy), (sx + length, sy), (sx + length, sy + 10), (sx, sy + 10),],
-            (000, 000, 000),
-        )
+        bar = [(sx, sy), (sx + length, sy), (sx + length, sy + 10), (sx, sy + 10)]
+        gfx.filled_polygon(gui.screen, bar, (000, 000, 000))
+        gui.invalidate_polygon(bar)
         gfx.filled_polygon(
             gui.screen,
             [(sx, sy), (sx + wl + dl, sy), (sx + wl + dl, sy + 10), (sx, sy + 10),],
@@ -93,6 +91,7 @@ class Explorer:
     @staticmethod
     def clear_render(gui):
         gfx.filled_polygon(gui.screen, Explorer.panel, (21, 21, 21))
+        gui.invalidate_polygon(Explorer.panel)
 
     def render(self, gui):
         # gui.action_execute.append(lambda: self.clear_render(gui))
@@ -104,10 +103,6 @@ class Explorer:
             #           for i, c in enumerate(self.forwards)]
             for i, c in enumerate(self.forwards):
                 c.render(gui, (sx, sy + i * 20))
-        if 1:
-            gui.d_manager.submit(gui.refresh)
-            # gui.refresh()
-            # gui.action_queue.extend(buffer)
 
     def __repr__(self):
         return repr(self.forwards)
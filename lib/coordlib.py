@@ -1,4 +1,5 @@
 from typing import Iterable
+from weakref import WeakKeyDictionary
 
 import pygame as pg
 
@@ -8,8 +9,20 @@ from . import baselib as bs
 class CoordinateManager(dict):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # The scaled copy of each surface at the current scale factor
+        self.surfaces = WeakKeyDictionary()
         self.scale_factor = 1
 
+    @property
+    def scale_factor(self):
+        return self._scale_factor
+
+    @scale_factor.setter
+    def scale_factor(self, value):
+        if value != getattr(self, "_scale_factor", None):
+            self.surfaces.clear()
+        self._scale_factor = value
+
     def __getitem__(self, item):
         return self.scale(super().__getitem__(item))
 
@@ -18,11 +31,29 @@ class CoordinateManager(dict):
             iter(item)
             return item.__class__([self.scale(i) for i in item])
         elif isinstance(item, pg.Surface):
-            size = item.get_size()
-            return pg.transform.smoothscale(item, self.scale(size))
+            return self.scale_surface(item)
         else:
             return item * self.scale_factor
 
+    def scale_surface(self, surface):
+        """
+        Returns a surface scaled by the scale factor.
+
+        Scaled surfaces are cached until the scale factor changes, and
+        surfaces are used as they are at a scale factor of 1.
+
+        :param surface: the ``pygame.Surface``
+        :return: the scaled ``pygame.Surface``
+        """
+        if self.scale_factor == 1:
+            return surface
+        try:
+            return self.surfaces[surface]
+        except KeyError:
+            size = self.scale(surface.get_size())
+            scaled = self.surfaces[surface] = pg.transform.smoothscale(surface, size)
+            return scaled
+
 
 class GUI:
     pass
@@ -1,4 +1,5 @@
 import json
+import sqlite3
 import threading
 import time
 import webbrowser
@@ -6,6 +7,7 @@ from pathlib import Path
 
 import chess
 import chess.engine
+import chess.polyglot
 import pygame.gfxdraw as gfx
 
 
@@ -37,17 +39,132 @@ class AnalysisDisplay:
 
     def add(self, info, board):
         if info.get("score") is not None:
-            ogboard = board.copy()
-            for i, move in enumerate(info.get("pv")):
-                board.push(move)
-            san = ogboard.variation_san(board.move_stack)
-            score = str(info.get("score"))
-            score = score if ogboard.turn else flip_eval(score)
-            score = eval_to_str(score)
-
-            self.queue.append(f"{score} {info.get('depth')} {san}")
+            line = format_line(board, str(info["score"]), info.get("depth"), info["pv"])
+            self.queue.append(line)
             self.print()
 
+    def show(self, lines):
+        """
+        Displays finished lines at once, such as the ones of a stored analysis.
+
+        :param lines: the list of line strings in multipv order
+        :return: None
+        """
+        self.clear()
+        self.pre_display()
+        for i, line in enumerate(lines, 1):
+            self.raw_display(i, line)
+        self.post_display()
+
+
+def format_line(board, score, depth, pv):
+    """
+    Returns the text of an analysis line.
+
+    :param board: the chess.Board of the position
+    :param score: the str of the ``chess.engine.PovScore`` of the line
+    :param depth: the depth of the line
+    :param pv: the list of chess.Move of the line
+    :return: the string of the score, depth and moves
+    """
+    san = board.variation_san(pv)
+    score = score if board.turn else flip_eval(score)
+    return f"{eval_to_str(score)} {depth} {san}"
+
+
+class AnalysisStore:
+    """
+    Keeps the deepest analysis of each position in an sqlite database.
+
+    Positions are keyed by their zobrist hash and the name of the engine, the
+    epd of the position is kept to tell apart colliding hashes. Each entry has
+    the depth and the multipv lines as ``(score, depth, pv)`` with the str of
+    the ``chess.engine.PovScore`` and the uci of the moves.
+
+    ```python
+    store = AnalysisStore(Path.home() / ".waychess" / "analysis.sqlite3")
+    store.put(board, "Stockfish 12", 20, [("+23", 20, ["e2e4", "e7e5"])])
+    depth, lines = store.get(board, "Stockfish 12")
+    ```
+    """
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS analysis (
+                    position INTEGER NOT NULL,
+                    engine TEXT NOT NULL,
+                    epd TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    lines TEXT NOT NULL,
+                    time REAL NOT NULL,
+                    PRIMARY KEY (position, engine)
+                )
+                """
+            )
+
+    @staticmethod
+    def key(board):
+        """Returns the zobrist hash of the board as a signed sqlite integer"""
+        position = chess.polyglot.zobrist_hash(board)
+        return position - (1 << 64) if position >= 1 << 63 else position
+
+    def get(self, board, engine):
+        """
+        Returns the stored analysis of a position.
+
+        :param board: the chess.Board of the position
+        :param engine: the name of the engine
+        :return: the ``(depth, lines)`` or None if it was not analysed
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT epd, depth, lines FROM analysis"
+                " WHERE position = ? AND engine = ?",
+                (AnalysisStore.key(board), engine),
+            ).fetchone()
+        if row is None or row[0] != board.epd():
+            return None
+        return row[1], [tuple(line) for line in json.loads(row[2])]
+
+    def put(self, board, engine, depth, lines):
+        """
+        Stores the analysis of a position unless a deeper one is stored.
+
+        :param board: the chess.Board of the position
+        :param engine: the name of the engine
+        :param depth: the depth reached by all the lines
+        :param lines: the list of ``(score, depth, pv)`` in multipv order
+        :return: None
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (position, engine) DO UPDATE SET
+                    epd = excluded.epd,
+                    depth = excluded.depth,
+                    lines = excluded.lines,
+                    time = excluded.time
+                WHERE excluded.depth > analysis.depth OR excluded.epd != analysis.epd
+                """,
+                (
+                    AnalysisStore.key(board),
+                    engine,
+                    board.epd(),
+                    depth,
+                    json.dumps(lines),
+                    time.time(),
+                ),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
 
 def flip_eval(ev):
     """Flips the evaluation from + to - and - to +"""
@@ -71,20 +188,43 @@ def eval_to_str(ev):
 
 
 def analysis(
-    engine, display, board=chess.Board(), end=lambda: False, options={"multipv": 3}
+    engine,
+    display,
+    board=chess.Board(),
+    end=lambda: False,
+    options={"multipv": 3},
+    store=None,
 ):
     """
     Syncronous analysis for use in a threading.Thread
 
+    Lines which are not deeper than the stored analysis are not displayed,
+    each depth reached by every line beyond it is stored.
+
     :param engine: the awaited chess.engine.popen_uci engine
     :param display: the display queue for analysis
     :param board: the chess.Board() of the position
     :param end: the function telling whether to stop analysis
+    :param store: the ``AnalysisStore`` keeping the analysis or None
     """
+    name = engine.id.get("name", "")
+    stored = store.get(board, name) if store is not None else None
+    shown = best = stored[0] if stored is not None else 0
+    count = min(options.get("multipv", 1), board.legal_moves.count())
+    lines = dict()
     try:
         with engine.analysis(board, **options) as analysis:
             for info in analysis:
-                display.add(info, chess.Board(board.fen()))
+                depth = info.get("depth", 0)
+                if depth > shown:
+                    display.add(info, chess.Board(board.fen()))
+                if store is not None and info.get("score") is not None:
+                    multipv = info.get("multipv", 1)
+                    pv = [move.uci() for move in info.get("pv", [])]
+                    lines[multipv] = (str(info["score"]), depth, pv)
+                    if multipv == count == len(lines) and depth > best:
+                        best = depth
+                        store.put(board, name, depth, [lines[i] for i in sorted(lines)])
 
                 if end():
                     return
@@ -123,8 +263,7 @@ class GUIAnalysis(AnalysisDisplay):
         self.gui.d_manager.submit(task)
 
     def post_display(self):
-        self.gui.manager.draw_ui(self.gui.screen)
-        self.gui.refresh()
+        self.gui.request_frame()
 
 
 def get_config(default_options={}):
@@ -143,6 +282,18 @@ def get_config(default_options={}):
 
 class GUI:
     engine_panel = [(35, 590), (515, 590), (515, 755), (35, 755)]
+    # The depth to stop analysing at, None to analyse until stopped
+    analysis_depth = None
+
+    @property
+    def analysis_store(self):
+        """The ``AnalysisStore`` of the analysed positions, kept in ~/.waychess"""
+        try:
+            return self._analysis_store
+        except AttributeError:
+            path = Path(self.pwd) / "analysis.sqlite3"
+            self._analysis_store = AnalysisStore(path)
+            return self._analysis_store
 
     def clear_analysis(self):
         self.stdout("cleared")
@@ -177,19 +328,37 @@ class GUI:
         self.show_engine = True
         self.analysis_display = GUIAnalysis(self)
 
+        board = self.board
+        stored = self.analysis_store.get(board, self.engine.id.get("name", ""))
+        if stored is not None:
+            depth, lines = stored
+            self.analysis_display.show(
+                [
+                    format_line(board, score, line_depth, map(chess.Move.from_uci, pv))
+                    for score, line_depth, pv in lines
+                ]
+            )
+            if self.analysis_depth is not None and depth >= self.analysis_depth:
+                self.stdout("Using stored analysis of depth", depth)
+                return
+
         def get_end():
             nonlocal self
             return not self.is_analysing
 
+        options = {"multipv": 3}
+        if self.analysis_depth is not None:
+            options["limit"] = chess.engine.Limit(depth=self.analysis_depth)
         self.t_manager.submit(
             threading.Thread(
                 target=analysis,
                 args=(
                     self.engine,
                     self.analysis_display,
-                    self.board,
+                    board,
                     get_end,
-                    {"multipv": 3,},
+                    options,
+                    self.analysis_store,
                 ),
                 daemon=True,
             )
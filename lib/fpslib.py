@@ -1,30 +1,215 @@
+import json
 import time
-from threading import Lock, Thread
+from collections import deque
+from threading import Lock, Thread, local
 
+import pygame as pg
 
-class FPSMonitor(Thread):
-    def __init__(self, filename="log", interval=1, *args, **kwargs):
-        Thread.__init__(self, *args, **kwargs)
-        self.refreshes = 0
+# The phases of a frame in the order they are shown
+PHASES = ("events", "board", "history", "arrows", "ui update", "ui draw", "flip")
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which a fraction of the values lie.
+
+    :param values: the sorted list of values
+    :param fraction: the fraction between 0 and 1
+    :return: the value, 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class NullPhase:
+    """A phase which is not timed, used while profiling is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Phase:
+    """Times a phase, leaving out the time of the phases nested in it"""
+
+    __slots__ = ("profiler", "name", "start", "nested")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.nested = 0.0
+
+    def __enter__(self):
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = self.profiler.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.profiler.add(self.name, elapsed - self.nested)
+        return False
+
+
+class FrameProfiler(Thread):
+    """
+    Times the phases of every frame.
+
+    The time of each phase is summed until ``end_frame`` is called. The last
+    ``window`` frames are kept to compute the percentiles, which are written
+    to a json lines file every ``interval`` seconds.
+
+    ```python
+    profiler = FrameProfiler("frames.jsonl")
+    profiler.start()
+    with profiler.phase("board"):
+        draw_board()
+    profiler.end_frame()
+    ```
+    """
+
+    null_phase = NullPhase()
+
+    def __init__(
+        self, filename="frames.jsonl", interval=1, window=600, enabled=True, **kwargs
+    ):
+        Thread.__init__(self, **kwargs)
+        self.daemon = True
         self.filename = filename
         self.interval = interval
+        self.enabled = enabled
         self.lock = Lock()
-        self.daemon = True
+        self.local = local()
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.frames = {name: deque(maxlen=window) for name in PHASES + ("frame",)}
+        self.frame_count = 0
+
+    @property
+    def stack(self):
+        """The phases being timed in the current thread"""
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def phase(self, name):
+        """
+        Returns the context manager timing a phase.
+
+        :param name: the name of the phase in ``PHASES``
+        :return: the ``Phase``
+        """
+        if not self.enabled:
+            return FrameProfiler.null_phase
+        return Phase(self, name)
+
+    def add(self, name, seconds):
+        """Adds time to a phase of the current frame"""
+        with self.lock:
+            self.current[name] += seconds
+
+    def end_frame(self):
+        """Records the phases of the current frame and starts the next one"""
+        if not self.enabled:
+            return
+        with self.lock:
+            current, self.current = self.current, dict.fromkeys(PHASES, 0.0)
+            self.frame_count += 1
+            for name, seconds in current.items():
+                self.frames[name].append(seconds)
+            self.frames["frame"].append(sum(current.values()))
 
-    def increment(self):
+    def stats(self):
+        """
+        Returns the percentiles of each phase over the recent frames.
+
+        :return: the dict of phase name to dict of "p50", "p95" and "p99"
+                 milliseconds
+        """
         with self.lock:
-            self.refreshes += 1
+            frames = {name: sorted(times) for name, times in self.frames.items()}
+        return {
+            name: {
+                f"p{p}": round(percentile(times, p / 100) * 1000, 3)
+                for p in (50, 95, 99)
+            }
+            for name, times in frames.items()
+        }
 
     def run(self):
-        with open(self.filename, "w+") as fout:
+        with open(self.filename, "a") as fout:
             while not time.sleep(self.interval):
-                print(
-                    self.refreshes // self.interval, "fps", file=fout, flush=True,
-                )
-                self.refreshes = 0
+                with self.lock:
+                    count, self.frame_count = self.frame_count, 0
+                record = {
+                    "time": round(time.time(), 3),
+                    "fps": count / self.interval,
+                    "phases": self.stats(),
+                }
+                print(json.dumps(record), file=fout, flush=True)
 
 
 class GUI:
+    # The top left of the profiler overlay
+    profile_overlay_pos = (0, 0)
+
     def create_fps_monitor(self):
-        self.fps_monitor = FPSMonitor("log", 0.4 if self.debug else 5)
-        self.fps_monitor.start()
+        """Creates the frame profiler, which only runs with --debug"""
+        self.profiler = FrameProfiler("frames.jsonl", enabled=self.debug)
+        self.show_profile = False
+        self.profile_drawn = 0
+        if self.debug:
+            self.profiler.start()
+
+    def toggle_profile(self):
+        """Shows or hides the frame profiler overlay"""
+        if self.profiler.enabled:
+            self.show_profile = not self.show_profile
+            self.profile_drawn = 0
+            self.background()
+
+    def draw_profile(self):
+        """
+        Draws the percentiles of each phase over the top left of the board.
+
+        The numbers are updated at most twice a second, but the overlay is
+        drawn on every frame so that the board is not drawn over it.
+
+        :return: None
+        """
+        if not self.show_profile:
+            return
+        if time.time() - self.profile_drawn >= 0.5:
+            self.profile_drawn = time.time()
+            self.profile_surface = self.render_profile()
+        pos = self.profile_overlay_pos
+        self.invalidate(self.screen.blit(self.profile_surface, pos))
+
+    def render_profile(self):
+        """
+        Renders the percentiles of each phase.
+
+        :return: the ``pygame.Surface`` of the overlay
+        """
+        stats = self.profiler.stats()
+        lines = ["frame time p50 / p95 / p99 ms"]
+        for name in ("frame",) + PHASES:
+            p = stats[name]
+            lines.append(f"{name}: {p['p50']:.2f} / {p['p95']:.2f} / {p['p99']:.2f}")
+
+        font = self.font_xs
+        height = font.get_linesize()
+        width = max(font.size(line)[0] for line in lines)
+        surface = pg.Surface((width + 10, height * len(lines) + 10))
+        surface.fill((21, 21, 21))
+        for i, line in enumerate(lines):
+            rendered = font.render(line, True, (234, 234, 234), (21, 21, 21))
+            surface.blit(rendered, (5, 5 + i * height))
+        return surface
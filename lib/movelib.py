@@ -4,17 +4,16 @@ import chess
 class GUI:
     """The backend for making moves for the gui"""
 
-    def draw_piece(self, piece, position):
+    def draw_piece(self, piece, position, clear=True):
         """
         Displays the piece at the position
 
         :param piece: the letter of the piece
         :param position: the (x,y) tuple of the position
+        :param clear: whether to draw the square under the piece first
         :returns: None
         """
-        if piece in "kK" and self.is_checked(piece):
-            self.blit(self.check, self.get_coords(*position))
-        else:
+        if clear:
             self.draw_square(*position)
         with self.display_lock:
             self.blit(self.piece_to_img[piece], self.get_coords(*position))
@@ -69,6 +68,11 @@ class GUI:
         else:
             self.node = self.node.add_variation(move)
         self.move += 0.5
+        self.mark_game_dirty()
+
+    def mark_game_dirty(self):
+        """Keeps the edits of the current game in the database"""
+        self.database.mark_dirty(self.game, self.node.game())
 
     def draw_promote_menu(self, coords, in_focus=None):
         """
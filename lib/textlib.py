@@ -1,8 +1,9 @@
 import itertools
-import re
 import sys
 import time
+from collections import OrderedDict
 
+import pygame
 import pygame.gfxdraw as gfx
 
 
@@ -76,9 +77,62 @@ def get_variation_menu_item(coordlist, mouse_x, mouse_y):
             return i
 
 
+def san_line(board, nodes):
+    """
+    Returns the san of the moves of consecutive nodes.
+
+    :param board: the ``chess.Board`` before the first move, which is changed
+    :param nodes: the list of ``chess.pgn.ChildNode``
+    :return: the list of san strings
+    """
+    sans = []
+    for node in nodes:
+        sans.append(board.san(node.move))
+        board.push(node.move)
+    return sans
+
+
+def history_rows(nodes, sans, counter=1):
+    """
+    Returns the history rows of a line, two half moves per row.
+
+    Rows with a move that has multiple variations have a * in front.
+
+    :param nodes: the list of ``chess.pgn.ChildNode`` starting at a white move
+    :param sans: the list of the san of each node
+    :param counter: the move number of the first row
+    :return: the list of row strings
+    """
+    rows = []
+    for i in range(0, len(nodes), 2):
+        row = f"{counter + i // 2}. " + " ".join(sans[i : i + 2])
+        if any(len(node.variations) > 1 for node in nodes[i : i + 2]):
+            row = "*" + row
+        rows.append(row)
+    return rows
+
+
+def emphasize_row(rows, emphasis):
+    """
+    Returns the rows with the row of the current move marked by a tab.
+
+    :param rows: the list of row strings
+    :param emphasis: the current move
+    :return: the new list of rows
+    """
+    rows = list(rows)
+    row = int(emphasis - 0.5)
+    if not 0 <= row < len(rows):
+        row = -1
+    rows[row] = "\t" + rows[row]
+    return rows
+
+
 class GUI:
     moves_panel = [(580, 65), (750, 65), (750, 555), (580, 555)]
     hist_slot_height = 30
+    hist_rows = 15
+    text_cache_size = 512
 
     def textlib_process_mouse_over(self, coords):
         """
@@ -90,10 +144,13 @@ class GUI:
         # Update the variation menu
         if self.display_variation_menu:
             var_menu_coords = self.__get_var_menu_coords()
+            emphasis = self.variation_menu_emphasis
             self.variation_menu_emphasis = get_variation_menu_item(
                 var_menu_coords, *coords
             )
-            self.draw_variation_menu()
+            if self.variation_menu_emphasis != emphasis:
+                changed = {emphasis, self.variation_menu_emphasis} - {None}
+                self.draw_variation_menu(changed)
 
     def textlib_process_mouse_click(self, coords):
         """
@@ -104,15 +161,71 @@ class GUI:
         """
         var_menu_coords = self.__get_var_menu_coords()
         loc = get_variation_menu_item(var_menu_coords, *coords)
+        ply = None if self.display_variation_menu else self.history_ply_at(*coords)
         if self.display_variation_menu and loc is not None:
             self.node = self.node.variations[loc]
             self.move += 0.5
         elif self.display_variation_menu:
             self.display_variation_menu = False
             self.render_history()
+        elif ply is not None and self.history_cache[0][ply] is not self.node:
+            self.jump_to_ply(ply)
         elif loc == 0:
             self.__initiate_variation_menu()
 
+    def textlib_process_mouse_wheel(self, coords, rows):
+        """
+        Scrolls the history when the mouse is over it.
+
+        :param coords: the raw mouse coordinates
+        :param rows: the rows to scroll down, negative to scroll up
+        :return: None
+        """
+        if self.display_variation_menu or not self.in_history(*coords):
+            return
+        limit = max(len(self.move_hist) - GUI.hist_rows, 0)
+        top = min(max(self.history_top + rows, 0), limit)
+        if top != self.history_top:
+            self.history_top = top
+            self.render_history()
+
+    def in_history(self, x, y):
+        """Returns whether the raw coordinates are in the shown history panel"""
+        (left, top), (right, bottom) = GUI.moves_panel[0], GUI.moves_panel[2]
+        return not self.show_explorer and left <= x <= right and top <= y <= bottom
+
+    def history_ply_at(self, x, y):
+        """
+        Returns the half move of the history at the raw coordinates.
+
+        :param x: the raw x coordinate
+        :param y: the raw y coordinate
+        :return: the index of the node in the line of the history or None
+        """
+        if not self.in_history(x, y):
+            return None
+        slot = (y - 75) // GUI.hist_slot_height
+        row = self.history_top + slot
+        if not 0 <= slot < GUI.hist_rows or not row < len(self.move_hist):
+            return None
+
+        ply = row * 2
+        text = self.move_hist[row].lstrip()
+        parts = text.split(" ")
+        if len(parts) > 2:
+            white = " ".join(parts[:2]) + " "
+            ply += x >= self.text_left(text) + self.font_small.size(white)[0]
+        return ply if ply < len(self.history_cache[0]) else None
+
+    def jump_to_ply(self, ply):
+        """
+        Goes to a half move of the line in the history, keeping the line.
+
+        :param ply: the index of the node in the line of the history
+        :return: None
+        """
+        self.go_to_node(self.history_cache[0][ply], keep_path=True)
+
     def textlib_process_key_press(self, event):
         """
         Processes key press input for textlib.
@@ -132,105 +245,177 @@ class GUI:
                 self.__initiate_variation_menu()
         elif key == 274:
             if self.display_variation_menu:
+                emphasis = self.variation_menu_emphasis
                 self.variation_menu_emphasis += 1
                 self.variation_menu_emphasis %= min(14, len(self.node.variations))
-                self.draw_variation_menu()
+                self.draw_variation_menu({emphasis, self.variation_menu_emphasis})
         elif key == 273:
             if self.display_variation_menu:
+                emphasis = self.variation_menu_emphasis
                 self.variation_menu_emphasis -= 1
                 self.variation_menu_emphasis %= min(14, len(self.node.variations))
-                self.draw_variation_menu()
+                self.draw_variation_menu({emphasis, self.variation_menu_emphasis})
         elif key == 13 or key == 275:
             if self.display_variation_menu:
                 self.node = self.node.variations[self.variation_menu_emphasis]
                 self.move += 0.5
 
-    def draw_variation_menu(self):
+    def draw_variation_menu(self, items=None):
+        """
+        Draws the items of the variation menu, highlighting the emphasized one.
+
+        :param items: the indices of the items to draw, all of them by default
+        :return: None
+        """
         if self.node.variations[1:]:
             try:
-                coords = self.__get_var_menu_coords()
-                for i, v, c in zip(itertools.count(), self.node.variations, coords):
-                    try:
-                        text = re.search(r"\((.+)\.\.\.\)", repr(v)).group(1)
-                    except Exception:
-                        text = ""
-                    color = (
-                        (0, 0, 0) if i != self.variation_menu_emphasis else (42, 42, 42)
-                    )
-                    gfx.filled_polygon(self.screen, c, color)
-                    try:
-                        self.render_text(
-                            text, (None, c[0][1] + 5), True, color  # (None, y),
-                        )
-                    except Exception as e:
-                        print(e)
+                rows = self.variation_menu_rows()
             except AttributeError as e:
                 self.stderr(e)
+                return
+            for i in range(len(rows)) if items is None else items:
+                pos, plain, emphasized = rows[i]
+                surface = emphasized if i == self.variation_menu_emphasis else plain
+                self.invalidate(self.screen.blit(surface, pos))
+
+    def variation_menu_rows(self):
+        """
+        Returns the rendered items of the variation menu at the current node.
+
+        The plain and emphasized surfaces of each item are rendered once when
+        the menu opens, so moving the emphasis only blits two of them.
+
+        :return: the list of ``(pos, plain, emphasized)`` of each item
+        """
+        key = (self.node, tuple(self.node.variations), self._initial_variation_y)
+        try:
+            menu_key, rows = self.variation_menu
+            if menu_key == key:
+                return rows
+        except AttributeError:
+            pass
+
+        rows = []
+        labels = self.variation_labels(self.node)
+        menu = list(zip(self.__get_var_menu_coords(), labels))
+        for i, (coords, label) in enumerate(menu):
+            (left, top), (right, bottom) = coords[0], coords[2]
+            # The bottom edge of an item is covered by the next item
+            height = bottom - top + (i == len(menu) - 1)
+            surfaces = []
+            for color in ((0, 0, 0), (42, 42, 42)):
+                surface = pygame.Surface((right - left + 1, height))
+                surface.fill(color)
+                rendered = self.render_cached(
+                    self.font_small, label, (255, 255, 255), color
+                )
+                surface.blit(rendered, (self.text_left(label) - left, 5))
+                surfaces.append(surface)
+            rows.append(((left, top), *surfaces))
+        self.variation_menu = (key, rows)
+        return rows
+
+    def variation_labels(self, node):
+        """
+        Returns the labels of the variations of a node, such as ``"3... Nc6 "``.
+
+        The sans are taken from the history when the variation is shown in
+        it, otherwise from the cached board of the node.
+
+        :param node: the ``chess.pgn.GameNode``
+        :return: the list of labels in the order of the variations
+        """
+        board = self.board_at(node)
+        number = f"{board.fullmove_number}{'.' if board.turn else '...'} "
+        ply = self.tree_index(node).ply(node)
+        try:
+            nodes, _, sans, _ = self.history_cache
+        except AttributeError:
+            nodes = sans = ()
+        labels = []
+        for child in node.variations:
+            if ply < len(nodes) and nodes[ply] is child:
+                san = sans[ply]
+            else:
+                san = board.san(child.move)
+            labels.append(f"{number}{san} ")
+        return labels
 
     def render_history(self):
         """
-        Renders the history with autoscroll.
+        Renders the history, scrolling to the current move if it changed.
 
         To implement:
           * Move comments
           * Move marks eg. ! ?
         """
-        with self.display_lock:
+        with self.profiler.phase("history"), self.display_lock:
             if self.changed_hist:
-                self.move_hist = self.render_history_task()
+                self.move_hist = self.history_model()
+                self.history_top = self.follow_row(self.move_hist)
                 self.changed_hist = False
-            else:
-                self.render_history_task(self.move_hist)
+            self.render_history_task(self.move_hist)
 
-    def render_history_task(self, moves=None):
+    def history_model(self):
         """
-        Renders the history with autoscroll.
+        Returns the rows of the history with the current move marked.
 
-        To implement:
-          * Move comments
-          * Move marks eg. ! ?
+        :return: the list of row strings
         """
-        gfx.filled_polygon(self.screen, GUI.moves_panel, (21, 21, 21))
-        game = self.node.game()
-
         try:
-            if moves is None:
-                moves = self.__get_move_text_history(
-                    game, self.move, self.variation_path[1:]
-                )
+            return emphasize_row(self.move_text_history(self.node.game()), self.move)
         except IndexError:
-            moves = []
+            return []
         except Exception:
             self.exit()
 
+    def current_row(self, moves):
+        """Returns the index of the row with the current move"""
+        row = int(self.move - 0.5)
+        return row if 0 <= row < len(moves) else len(moves) - 1
+
+    def follow_row(self, moves):
+        """
+        Returns the top row of the history which shows the current move.
+
+        The history only scrolls when the current move is out of view, and
+        then centers it.
+
+        :param moves: the list of row strings
+        :return: the index of the top row
+        """
+        try:
+            top = self.history_top
+        except AttributeError:
+            top = 0
+        row = self.current_row(moves)
+        if not top <= row < top + GUI.hist_rows:
+            top = row - GUI.hist_rows // 2
+        return min(max(top, 0), max(len(moves) - GUI.hist_rows, 0))
+
+    def render_history_task(self, moves):
+        """
+        Renders the rows of the history which are in view.
+
+        :param moves: the list of row strings
+        :return: the list of row strings
+        """
+        (left, top), (right, bottom) = GUI.moves_panel[0], GUI.moves_panel[2]
+        width, height = right - left + 1, bottom - top + 1
+        self.invalidate(self.screen.fill((21, 21, 21), (left, top, width, height)))
+
+        # dy of -5 is needed to align the highlight
+        dy = -5
+        first = self.history_top
         y = 80
-        move_amount = len(moves)
-        if move_amount < 15:
-            moves.extend([" " * 20] * (15 - move_amount))
-        elif 8 <= int(self.move) < move_amount - 8:
-            b = int(self.move - 0.5) - 8
-            b = 0 if b < 0 else b
-            moves = moves[b : int(self.move - 0.5) + 8]
-        elif int(self.move) < 8:
-            moves = moves[:15]
-
-        moves = moves[-15:]
-        for move in moves:
+        self._initial_variation_y = (
+            y + dy + (self.current_row(moves) - first) * GUI.hist_slot_height
+        )
+        for move in moves[first : first + GUI.hist_rows]:
             # Highlight text if it is of the current move
             if move.startswith("\t"):
-                b_left = GUI.moves_panel[0][0]
-                b_right = GUI.moves_panel[1][0]
-
-                # dy of -5 is needed to align the highlight
-                dy = -5
-                rect = [
-                    (b_left, y + dy),
-                    (b_right, y + dy),
-                    (b_right, y + dy + GUI.hist_slot_height),
-                    (b_left, y + dy + GUI.hist_slot_height),
-                ]
-                gfx.filled_polygon(self.screen, rect, (0, 0, 0))
-                self._initial_variation_y = y + dy
+                rect = (left, y + dy, width, GUI.hist_slot_height + 1)
+                self.screen.fill((0, 0, 0), rect)
             self.render_text(
                 move.lstrip(),
                 (None, y),
@@ -238,28 +423,82 @@ class GUI:
                 (0, 0, 0) if move.startswith("\t") else (21, 21, 21),
             )
             y += GUI.hist_slot_height
+
+        # The scroll bar
+        if len(moves) > GUI.hist_rows:
+            bar_top = top + height * first // len(moves)
+            bar_height = max(height * GUI.hist_rows // len(moves), 4)
+            self.screen.fill((90, 90, 90), (right - 2, bar_top, 3, bar_height))
+
         if "--always-variation" in sys.argv or self.display_variation_menu:
             self.draw_variation_menu()
         return moves
 
+    def render_lines(self, lines):
+        """
+        Renders lines of small text in place of the history.
+
+        :param lines: the list of strings to render
+        :return: None
+        """
+        with self.display_lock:
+            gfx.filled_polygon(self.screen, GUI.moves_panel, (21, 21, 21))
+            self.invalidate_polygon(GUI.moves_panel)
+            x, y = GUI.moves_panel[0]
+            for i, line in enumerate(lines):
+                pos = (x + 5, y + 15 + i * 20)
+                self.render_raw_text(line, pos, self.font_xs, (234, 234, 234))
+
     def render_text(self, text, pos=(None, 20), small=False, background=(21, 21, 21)):
         """Renders text, centered by default"""
-        SQUARE_SIZE = self.SQUARE_SIZE
-        left_boundary = SQUARE_SIZE * 9
         if pos[0] is None:
-            right_boundary = 600
-            text_len = len(text)
-            left = left_boundary + (right_boundary - left_boundary - text_len) // 2
-            pos = (left, pos[1])
+            pos = (self.text_left(text), pos[1])
         font = self.font_small if small else self.font
-        rendered = font.render(text, True, (255, 255, 255), background)
+        rendered = self.render_cached(font, text, (255, 255, 255), background)
         # brendered = font.render('G'*100, True, (21, 21, 21), (21, 21, 21))
         # self.screen.blit(brendered, (left_boundary-5, pos[1]))
-        self.screen.blit(rendered, pos)
+        self.invalidate(self.screen.blit(rendered, pos))
+
+    def text_left(self, text):
+        """Returns the left x coordinate of text centered by render_text"""
+        left_boundary = self.SQUARE_SIZE * 9
+        right_boundary = 600
+        return left_boundary + (right_boundary - left_boundary - len(text)) // 2
 
     def render_raw_text(self, text, pos, font, color, background=(21, 21, 21)):
-        rendered = font.render(text, True, color, background)
-        self.screen.blit(rendered, pos)
+        rendered = self.render_cached(font, text, color, background)
+        self.invalidate(self.screen.blit(rendered, pos))
+
+    def render_cached(self, font, text, color, background):
+        """
+        Renders text, reusing the surface when the same text was rendered before.
+
+        The surfaces are kept in an LRU cache of ``self.text_cache_size`` items,
+        ``self.text_cache_hits`` and ``self.text_cache_misses`` count lookups.
+
+        :param font: the ``pygame.font.Font`` to render with
+        :param text: the string to render
+        :param color: the rgb tuple of the text
+        :param background: the rgb tuple of the background
+        :return: the rendered ``pygame.Surface``, which must not be changed
+        """
+        key = (font, text, tuple(color), tuple(background))
+        try:
+            cache = self.text_cache
+        except AttributeError:
+            cache = self.text_cache = OrderedDict()
+            self.text_cache_hits = self.text_cache_misses = 0
+
+        try:
+            cache.move_to_end(key)
+            rendered = cache[key]
+            self.text_cache_hits += 1
+        except KeyError:
+            rendered = cache[key] = font.render(text, True, color, background)
+            self.text_cache_misses += 1
+            while len(cache) > self.text_cache_size:
+                cache.popitem(last=False)
+        return rendered
 
     @staticmethod
     def __board_node_generator(beg, variation_path):
@@ -294,39 +533,54 @@ class GUI:
                     moves with variations will have * in front
                     the emphasis move will be marked with a front tab
         """
-        beg = game.variations[0]
-        tabbed = False
-        moves = []
-        # nodes will be tuple of either 2 nodes or 1 node
-        # it will be 2 nodes for a full move
-        #   and 1 node for a half move
-        any_l, len_l, int_l = any, len, int  # lookup time optimization
-        for counter, nodes in enumerate(
-            map(tuple, grouper_it(2, GUI.__board_node_generator(beg, variation_path))),
-            1,
-        ):
+        nodes = list(GUI.__board_node_generator(game.variations[0], variation_path))
+        sans = san_line(game.board(), nodes)
+        return emphasize_row(history_rows(nodes, sans), emphasis)
 
-            try:
-                n0s = nodes[0].parent.board().san(nodes[0].move)
-                n1s = nodes[1].parent.board().san(nodes[1].move)
-                s = f"{counter}. {n0s} {n1s}"
-            # If nodes has 1 element
-            except IndexError:
-                s = f"{counter}. {n0s}"
-
-            # Add a * if there are multiple variations
-            if any_l(len_l(n.variations) > 1 for n in nodes):
-                s = "*" + s
-
-            # Add a tab if the move is the current move
-            if counter - 1 == int_l(emphasis - 0.5):
-                s = "\t" + s
-                tabbed = True
-
-            moves.append(s)
-        if not tabbed:
-            moves[-1] = "\t" + moves[-1]
-        return moves
+    def move_text_history(self, game):
+        """
+        Returns the history rows of the current variation path.
+
+        The nodes, san and rows of the last line are cached, so only the moves
+        after the first node which differs from the cached line are converted
+        to san, from the cached board before that node.
+
+        :param game: the ``chess.pgn.Game`` of the current node
+        :return: the list of rows without emphasis, which must not be changed
+        """
+        nodes = list(
+            GUI.__board_node_generator(game.variations[0], self.variation_path[1:])
+        )
+        counts = [len(node.variations) for node in nodes]
+        try:
+            old_nodes, old_counts, sans, rows = self.history_cache
+        except AttributeError:
+            old_nodes, old_counts, sans, rows = [], [], [], []
+
+        # The nodes before same are unchanged
+        same = 0
+        for node, old_node in zip(nodes, old_nodes):
+            if node is not old_node:
+                break
+            same += 1
+        if same < len(nodes):
+            board = self.board_at(nodes[same].parent).copy()
+            sans = sans[:same] + san_line(board, nodes[same:])
+        else:
+            sans = sans[:same]
+
+        # The rows before start have the same moves and * marks
+        changed = same
+        for i, (count, old_count) in enumerate(zip(counts[:same], old_counts)):
+            if count != old_count:
+                changed = i
+                break
+        start = changed - changed % 2
+        rows = rows[: start // 2] + history_rows(
+            nodes[start:], sans[start:], start // 2 + 1
+        )
+        self.history_cache = (nodes, counts, sans, rows)
+        return rows
 
     def __get_var_menu_coords(self):
         try:
@@ -354,6 +608,9 @@ class GUI:
             self.stderr(e)
 
     def __initiate_variation_menu(self):
+        # Scroll the history to the current move, where the menu opens
+        self.changed_hist = True
+        self.render_history()
         self.display_variation_menu = True
         self.variation_menu_emphasis = 0
         self.draw_variation_menu()
@@ -0,0 +1,201 @@
+class TreeIndex:
+    """
+    A flattened index of a game tree.
+
+    The tree is split into lines, each made of a node and the nodes reached
+    by following the first variation from it, so the mainline is line 0 and
+    every other variation starts a line of its own. Each node maps to its
+    ``(ply, parent, slot, line)`` where ``slot`` is its index in the
+    variations of its parent.
+
+    ```python
+    index = TreeIndex(game)
+    index.ply(node), index.path(node), index.end(node)
+    ```
+    """
+
+    def __init__(self, game):
+        self.root = game
+        self.entries = dict()
+        self.lines = []
+        self.build()
+
+    def __contains__(self, node):
+        return node in self.entries
+
+    def build(self):
+        """Indexes the whole tree from the root"""
+        self.entries.clear()
+        self.lines.clear()
+        pending = [(self.root, None, 0, 0)]
+        while pending:
+            node, parent, slot, ply = pending.pop()
+            line = len(self.lines)
+            nodes = []
+            self.lines.append(nodes)
+            while True:
+                nodes.append(node)
+                self.entries[node] = (ply, parent, slot, line)
+                variations = node.variations
+                for i in range(len(variations) - 1, 0, -1):
+                    pending.append((variations[i], node, i, ply + 1))
+                if not variations:
+                    break
+                node, parent, slot, ply = variations[0], node, 0, ply + 1
+
+    def add(self, node):
+        """
+        Indexes a node which was just added to an indexed parent.
+
+        Appended variations are indexed in place, a new first variation
+        shifts the slots of its siblings so the tree is indexed again.
+
+        :param node: the new ``chess.pgn.GameNode``
+        :return: None
+        """
+        parent = node.parent
+        variations = parent.variations
+        ply, _, _, line = self.entries[parent]
+        if variations[-1] is not node:
+            self.build()
+        elif len(variations) == 1:
+            self.lines[line].append(node)
+            self.entries[node] = (ply + 1, parent, 0, line)
+        else:
+            slot, line = len(variations) - 1, len(self.lines)
+            self.entries[node] = (ply + 1, parent, slot, line)
+            self.lines.append([node])
+
+    def ply(self, node):
+        """Returns the number of half moves from the root to the node"""
+        return self.entries[node][0]
+
+    def slot(self, node):
+        """Returns the index of the node in the variations of its parent"""
+        return self.entries[node][2]
+
+    def line(self, node):
+        """Returns the nodes of the line which the node is on"""
+        return self.lines[self.entries[node][3]]
+
+    def line_plies(self, line):
+        """
+        Returns the half moves of a line.
+
+        :param line: the index of the line, 0 for the mainline
+        :return: the ``range`` of the plies of the nodes of the line
+        """
+        nodes = self.lines[line]
+        first = self.entries[nodes[0]][0]
+        return range(first, first + len(nodes))
+
+    def end(self, node):
+        """Returns the last node reached by following the first variations"""
+        return self.line(node)[-1]
+
+    def follow(self, node, path):
+        """
+        Returns the last node of the line given by a variation path.
+
+        The path is only read at the forks, so the line is not walked.
+
+        :param node: the ``chess.pgn.GameNode`` to start from
+        :param path: the list of the slot of the node at each ply from 1,
+                     missing slots are 0
+        :return: the ``chess.pgn.GameNode``
+        """
+        ply = self.ply(node)
+        while True:
+            nodes = self.line(node)
+            first = self.ply(nodes[0])
+            last = min(first + len(nodes) - 1, len(path))
+            fork = next((i for i in range(ply, last) if path[i]), None)
+            if fork is None:
+                return nodes[-1]
+            variations = nodes[fork - first].variations
+            if path[fork] >= len(variations):
+                return nodes[-1]
+            node, ply = variations[path[fork]], fork + 1
+
+    def path(self, node):
+        """
+        Returns the variation path from the root to a node.
+
+        Only the first node of each line can be in a slot other than 0, so
+        the path is made from one run of zeros per line.
+
+        :param node: the ``chess.pgn.GameNode``
+        :return: the list of the slot of the node at each ply from 1
+        """
+        runs = []
+        entries = self.entries
+        while True:
+            ply, _, _, line = entries[node]
+            first = self.lines[line][0]
+            first_ply, parent, slot, _ = entries[first]
+            runs.append([0] * (ply - first_ply))
+            if parent is None:
+                break
+            runs.append([slot])
+            node = parent
+        path = []
+        for run in reversed(runs):
+            path.extend(run)
+        return path
+
+
+class GUI:
+    """Navigation backend using the index of the game tree"""
+
+    @property
+    def tree(self):
+        """The index of the tree of the current game"""
+        return self.tree_index(self.node)
+
+    def tree_index(self, node):
+        """
+        Returns the index of the tree of a node.
+
+        The index is kept until a node of another tree is given, new children
+        of indexed nodes are added to it.
+
+        :param node: the ``chess.pgn.GameNode``
+        :return: the ``TreeIndex``
+        """
+        try:
+            index = self._tree_index
+            if node in index:
+                return index
+            if node.parent is not None and node.parent in index:
+                index.add(node)
+                return index
+        except AttributeError:
+            pass
+        index = self._tree_index = TreeIndex(node.game())
+        return index
+
+    def go_to_node(self, node, keep_path=False):
+        """
+        Goes to any node of the current game.
+
+        :param node: the ``chess.pgn.GameNode``
+        :param keep_path: whether to keep the variation path past the node
+        :return: None
+        """
+        variation_path = list(self.variation_path)
+        self.node = node
+        if keep_path:
+            self.variation_path = variation_path
+        self.move = self.tree.ply(node) / 2
+        self.set_board()
+
+    def go_to_start(self):
+        """Goes to the starting position, keeping the line in the history"""
+        if self.node.parent is not None:
+            self.go_to_node(self.tree.root, keep_path=True)
+
+    def go_to_end(self):
+        """Goes to the last move of the line in the history"""
+        end = self.tree.follow(self.node, self.variation_path)
+        if end is not self.node:
+            self.go_to_node(end, keep_path=True)
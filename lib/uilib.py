@@ -135,6 +135,7 @@ class GUI:
             with self.engine_box_lock:
                 self.create_engine_box_task(self.engine_box_queue[-1])
                 self.engine_box_queue[:] = []
+            self.request_frame()
         except Exception as e:
             self.stderr(e)
 
@@ -173,6 +174,17 @@ class GUI:
         except AttributeError:
             self.manager = pgg.UIManager((800, 850), self.pwd / "theme.json")
 
+    def draw_ui(self):
+        """Draws the ui elements over the screen"""
+        self.manager.draw_ui(self.screen)
+        self.invalidate(
+            *(
+                pg.Rect(sprite.rect.topleft, sprite.image.get_size())
+                for sprite in self.manager.get_sprite_group()
+                if sprite.visible
+            )
+        )
+
     def set_ui(self, val=None):
         if val is None:
             self.onui = not self.onui
@@ -186,6 +198,7 @@ class GUI:
                 if event.user_type == "ui_text_entry_finished":
                     self.stdout("[TEXTENTRY] FINISHED")
                     self.node.comment = event.text
+                    self.mark_game_dirty()
                     self.comment_edit_box.hide()
                     self.set_ui_comment()
 
@@ -7,9 +7,13 @@ class TGUI(lib.arrowlib.GUI):
         self.node.comment = ""
         self.key_pressed = {306: False}
         self._is_mac = False
+        self.white = True
         self.board = JSObj()
         self.board.turn = True
 
+    def mark_game_dirty(self):
+        pass
+
 
 def test_is_mac():
     gui = TGUI()
@@ -91,3 +95,39 @@ def test_arrow_set_str():
     }
     gui.write_arrows(arrow_set)
     assert gui.arrows == arrow_set
+
+
+def test_arrow_points_cache():
+    gui = TGUI()
+    gui.arrow_cache_size = 2
+    points, rect = gui.arrow_points((34, 34), (238, 374), 12)
+    assert points == lib.arrowlib.get_line_points(34, 34, 238, 374, 12)[0]
+    xs, ys = zip(*points)
+    assert rect == (min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+    assert gui.arrow_points((34, 34), (238, 374), 12)[0] is points
+
+    gui.arrow_points((34, 34), (102, 170), 12)
+    gui.arrow_points((34, 34), (34, 510), 12)
+    assert len(gui.arrow_cache) == 2
+    assert gui.arrow_points((34, 34), (238, 374), 12)[0] is not points
+
+
+def test_cal_arrows():
+    Arrow = lib.arrowlib.Arrow
+    gui = TGUI()
+    gui.node.comment = "Good move [%csl Gd4][%cal Ge2e4, Rd7d5]"
+    green, red = (0, 255, 0, 150), (255, 0, 0, 150)
+    e2e4, d7d5 = Arrow((4, 6), (4, 4), green), Arrow((3, 1), (3, 3), red)
+    assert gui.arrows == {e2e4, d7d5}
+    assert gui.arrows is gui.arrows, "Fails parsing once"
+
+    legacy = Arrow((10, 10), (20, 20), (20, 20, 20))
+    gui.add_arrow(legacy)
+    gui.remove_arrow(d7d5)
+    assert gui.node.comment == (
+        "[%cal Ge2e4] Good move [%csl Gd4] Arrows: " + str(legacy)
+    )
+    assert gui.arrows == {e2e4, legacy}
+
+    gui.white = False
+    assert gui.arrows == {Arrow((3, 1), (3, 3), green), legacy}
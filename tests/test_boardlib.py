@@ -1,3 +1,5 @@
+import chess.pgn
+
 from .context import JSObj, lib
 
 
@@ -16,3 +18,54 @@ def test_receive_coords():
     gui = TGUI()
     assert gui.receive_coords(0, 0) == (0, 0)
     assert gui.receive_coords(136, 0) == (2, 0)
+
+
+def test_board_at():
+    gui = TGUI()
+    game = chess.pgn.Game()
+    node = game.add_line(map(chess.Move.from_uci, ["e2e4", "e7e5", "g1f3"]))
+    side = node.parent.add_variation(chess.Move.from_uci("b1c3"))
+
+    assert gui.board_at(node).fen() == node.board().fen()
+    assert gui.board_at(node) is gui.board_at(node)
+    assert gui.board_at(side).fen() == side.board().fen()
+    assert gui.board_at(side).move_stack == side.board().move_stack
+    assert gui.board_at(node.parent) is gui.boards[node.parent]
+
+
+class DrawGUI(TGUI):
+    def __init__(self, node):
+        super().__init__()
+        self.node = node
+        self.white = True
+        self.is_promoting = False
+        self.profiler = lib.fpslib.FrameProfiler(enabled=False)
+        self.drawn = []
+
+    def draw_board(self, checked=frozenset()):
+        self.drawn.append("board")
+
+    def draw_piece(self, piece, position, clear=True):
+        self.drawn.append(position)
+
+    def draw_square(self, x, y):
+        self.drawn.append((x, y))
+
+    def arrow_squares(self):
+        return set()
+
+    def right_panel(self):
+        pass
+
+
+def test_set_board_redraws_changed_squares():
+    game = chess.pgn.Game()
+    gui = DrawGUI(game)
+    gui.set_board(set_arrows=False)
+    assert gui.drawn[0] == "board" and len(gui.drawn) == 33
+
+    gui.drawn = []
+    gui.node = game.add_variation(chess.Move.from_uci("e2e4"))
+    gui.set_board(set_arrows=False)
+    assert sorted(gui.drawn) == [(4, 4), (4, 6)]
+    assert gui.piece_at[(4, 4)] == "P"
@@ -12,3 +12,16 @@ def test_scale():
     assert cm["test"] == 2, "Fails linear scale"
     assert cm["test list"] == (2, 4), "Fails list scale"
     assert cm["test list of tuples"] == [(2, 4), (6, 8)], "Fails double list fail"
+
+
+def test_scale_surface():
+    cm = CoordinateManager()
+    surface = lib.coordlib.pg.Surface((10, 20))
+    assert cm.scale(surface) is surface, "Fails identity scale"
+    cm.scale_factor = 2
+    scaled = cm.scale(surface)
+    assert scaled.get_size() == (20, 40), "Fails surface scale"
+    assert cm.scale(surface) is scaled, "Fails surface cache"
+    cm.scale_factor = 3
+    assert len(cm.surfaces) == 0, "Fails eviction on rescale"
+    assert cm.scale(surface).get_size() == (30, 60)
@@ -1,3 +1,6 @@
+import os
+import threading
+
 from .context import core
 
 d = core.Database()
@@ -17,3 +20,400 @@ def test_database_indexing():
         assert False, "IndexError should have been raised"
     except IndexError:
         assert True, "IndexError should have been raised"
+
+
+PGN = """[Event "First"]
+[White "A"]
+[Black "B"]
+[Result "1-0"]
+
+1. e4 { a comment
+
+[%clk 0:01:00] spanning lines } e5 2. Nf3 ; [not a tag
+Nc6 1-0
+
+% escaped line
+
+[Event "Second"]
+[Result "*"]
+
+1. d4 d5 (1... Nf6 2. c4) *
+
+[Event "Third"]
+[Result "0-1"]
+
+1. c4 0-1
+"""
+
+
+def write_pgn(tmp_path, text=PGN):
+    path = tmp_path / "games.pgn"
+    path.write_text(text)
+    return path
+
+
+def test_database_lazy_loading(tmp_path):
+    path = write_pgn(tmp_path)
+    db = core.Database(path, cache_size=1)
+    assert len(db) == 3
+    assert db.cache == {}, "no game should be parsed up front"
+
+    with open(path) as fin:
+        for game in db:
+            assert str(game) == str(core.chess.pgn.read_game(fin))
+    assert len(db.cache) == 1, "the cache should be bounded"
+    assert db[-1].headers["Event"] == "Third"
+
+
+def test_database_edits_kept(tmp_path):
+    db = core.Database(write_pgn(tmp_path), cache_size=1)
+    db[0].comment = "edited"
+    db.mark_dirty(0)
+    db[1], db[2]
+    assert db[0].comment == "edited"
+
+
+def test_database_sidecar(tmp_path):
+    path = write_pgn(tmp_path)
+    db = core.Database(path)
+    assert (tmp_path / "games.pgn.wcidx").is_file(), "sidecar should be written"
+    assert db.index.headers(1)["Event"] == "Second"
+    db.index.close()
+
+    db = core.Database(path)
+    assert db.index.mmap is not None, "index should be memory-mapped"
+    assert db.index.headers(2) == {
+        "Event": "Third",
+        "Site": "?",
+        "Date": "?",
+        "Round": "?",
+        "White": "?",
+        "Black": "?",
+        "Result": "0-1",
+        "WhiteElo": "?",
+        "BlackElo": "?",
+        "ECO": "?",
+    }
+    assert db[2].headers["Event"] == "Third"
+    db.index.close()
+
+    path.write_text(PGN + '\n[Event "Fourth"]\n\n*\n')
+    db = core.Database(path)
+    assert len(db) == 4, "outdated sidecar should be rebuilt"
+
+
+def test_database_streaming_import(tmp_path):
+    path = write_pgn(tmp_path, PGN * 3)
+    with open(path, "rb") as fin:
+        built = core.GameIndex.build(fin)
+
+    calls = []
+    db = core.Database(path, progress=calls.append, memory_budget=1)
+    assert list(db.index.offsets) == list(built.offsets)
+    assert list(db.index.lengths) == list(built.lengths)
+    assert [db.index.headers(i) for i in range(9)] == [
+        built.headers(i) for i in range(9)
+    ]
+    assert calls[-1].games == 9
+    assert calls[-1].fraction == 1.0
+    db.close()
+
+
+def test_database_incremental_save(tmp_path):
+    path = write_pgn(tmp_path, PGN.rstrip("\n"))
+    db = core.Database(path)
+    game = db[1]
+    game.comment = "changed"
+    db.mark_dirty(1, game)
+    db.add()
+    db.save()
+
+    text = path.read_text()
+    first, second, third = PGN.split("[Event")[1:]
+    assert text.startswith("[Event" + first), "unchanged games should be copied"
+    assert "[Event" + third.rstrip("\n") + "\n\n" in text
+    assert "{ changed }" in text
+    assert db.edited == {}
+    assert not list(tmp_path.glob("*.tmp")) and not list(tmp_path.glob("tmp*"))
+
+    reopened = core.Database(path)
+    assert reopened.index.mmap is not None, "save should rewrite the sidecar"
+    assert len(reopened) == len(db) == 4
+    for i in range(4):
+        assert str(reopened[i]) == str(db[i])
+        assert reopened.index.headers(i) == db.index.headers(i)
+
+
+def test_database_save_while_editing(tmp_path):
+    path = write_pgn(tmp_path)
+    db = core.Database(path)
+    game = db[1]
+    game.comment = "saved"
+    db.mark_dirty(1, game)
+
+    install = db.install
+
+    def edit_while_saving(index):
+        game.comment = "after"
+        db.mark_dirty(1, game)
+        db.add()
+        install(index)
+
+    db.install = edit_while_saving
+    db.save()
+    assert "{ saved }" in path.read_text()
+    assert db.edited.keys() == {1, 3}, "edits made while saving should be kept"
+
+    db.install = install
+    db.save()
+    assert "{ after }" in path.read_text() and db.edited == {}
+    assert len(core.Database(path)) == 4
+
+
+def test_database_concurrent_saves(tmp_path):
+    path = write_pgn(tmp_path, PGN * 10)
+    db = core.Database(path)
+    db[0].comment = "first"
+    db.mark_dirty(0)
+    install = db.install
+    saves = []
+
+    def save_while_saving(index):
+        db.install = install
+        db[5].comment = "second"
+        db.mark_dirty(5)
+        saves.append(threading.Thread(target=db.save))
+        saves[0].start()
+        saves[0].join(0.2)
+        assert saves[0].is_alive(), "the second save should wait for the first"
+        install(index)
+
+    db.install = save_while_saving
+    db.save()
+    saves[0].join()
+    texts = [str(game) for game in core.Database(path)]
+    assert len(texts) == 30
+    assert "{ first }" in texts[0] and "{ second }" in texts[5]
+
+
+def test_database_save_changed_file(tmp_path):
+    path = write_pgn(tmp_path)
+    db = core.Database(path)
+    db.mark_dirty(0)
+    with open(path, "a") as fout:
+        fout.write("\n\n1. d4 *\n")
+    try:
+        db.save()
+        assert False, "ValueError should have been raised"
+    except ValueError:
+        assert True, "ValueError should have been raised"
+    assert path.read_text().endswith("1. d4 *\n"), "the file should be kept"
+
+
+def test_database_map(tmp_path):
+    db = core.Database(write_pgn(tmp_path))
+    db.add()
+    expected = [str(game) for game in db]
+    assert list(db.map(str, workers=2, chunk_size=1)) == expected
+    assert list(db.map(str, workers=1)) == expected
+
+
+def test_database_map_in_flight(tmp_path, monkeypatch):
+    db = core.Database(write_pgn(tmp_path, PGN * 10))
+    in_flight = []
+
+    class Future:
+        def __init__(self, result):
+            self.value = result
+            in_flight.append(self)
+
+        def result(self):
+            in_flight.remove(self)
+            return self.value
+
+    class Executor:
+        def __init__(self, workers):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def submit(self, func, *args):
+            future = Future(func(*args))
+            assert len(in_flight) <= 5, "at most 2 chunks per worker are queued"
+            return future
+
+    monkeypatch.setattr(core, "ProcessPoolExecutor", Executor)
+    expected = [str(game) for game in db]
+    assert list(db.map(str, workers=2, chunk_size=1)) == expected
+
+    file = tmp_path / "games.wcdb"
+    db.export(file, workers=1)
+    packed = core.Database(file)
+    assert list(packed.map(str, workers=2)) == expected
+
+
+def test_database_headers(tmp_path):
+    db = core.Database(write_pgn(tmp_path))
+    db.add()
+    db.edited[0] = db[0]
+    db[0].headers["White"] = "C"
+    headers = list(db.iter_headers())
+    assert db.cache.keys() == {0}, "only the edited game should be parsed"
+    assert headers == [db.headers(i) for i in range(len(db))]
+    assert headers[0] == dict(db[0].headers)
+    assert headers[1] == {"Event": "Second", "Result": "*"}
+    assert headers[3] == dict(core.chess.pgn.Game().headers)
+
+
+def test_database_find_position(tmp_path):
+    path = write_pgn(tmp_path)
+    db = core.Database(path)
+    board = core.chess.Board()
+    board.push_san("d4")
+    board.push_san("Nf6")
+    assert db.find_position(board, workers=1) == [(1, 2)]
+    assert db.position_index.mmap is None
+
+    board = core.chess.Board()
+    assert db.find_position(board) == [(0, 0), (1, 0), (2, 0)]
+    game = db[2]
+    game.variations[0].add_variation(core.chess.Move.from_uci("g8f6"))
+    db.mark_dirty(2, game)
+    board.push_san("c4")
+    board.push_san("Nf6")
+    assert db.find_position(board) == [(2, 2)], "edited games should be searched"
+
+    db = core.Database(path)
+    assert db.find_position(board) == []
+    assert db.position_index.mmap is not None, "sidecar should be reused"
+    db.close()
+
+    # Games edited before the index is built are still indexed as saved
+    (tmp_path / "games.pgn.wcpos").unlink()
+    db = core.Database(path)
+    db[2].variations[0].comment = "edited"
+    db.mark_dirty(2)
+    board = core.chess.Board()
+    board.push_san("c4")
+    assert db.find_position(board, workers=1) == [(2, 1)]
+    db.close()
+    assert core.Database(path).find_position(board) == [(2, 1)]
+
+
+def test_database_find_position_without_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = core.Database("")
+    assert db.find_position(core.chess.Board(), workers=1) == [(0, 0)]
+    assert list(tmp_path.iterdir()) == [], "no sidecar should be written"
+
+
+def test_database_query(tmp_path):
+    db = core.Database(write_pgn(tmp_path))
+    db.add()
+    db[3].headers.update(White="A", WhiteElo="2700", ECO="B95", Date="2020.07.??")
+    db.mark_dirty(3)
+
+    assert list(db.query(lambda c: c.equals("White", "A"))) == [0, 3]
+    assert list(db.query(lambda c: c.result == c.RESULTS["0-1"])) == [2]
+    assert list(
+        db.query(lambda c: (c.white_elo > 2600) & c.eco_between("B90", "B99"))
+    ) == [3]
+    assert list(db.query(lambda c: c.date >= 20200700)) == [3]
+    assert list(db.query(lambda c: c.where("Event", lambda e: "i" in e))) == [0, 2]
+    assert core.eco_code("B90") == 190
+    assert core.date_code("2020.07.??") == 20200700
+
+
+def test_header_columns_update(tmp_path):
+    path = write_pgn(tmp_path)
+    core.Database(path).close()
+    db = core.Database(path)
+    strings = db.index.strings
+    assert isinstance(strings, core.StringTable)
+    assert strings[strings.find("?")] == "?"
+    assert strings.find("missing") is None
+
+    columns = db.columns()
+    assert list(db.query(lambda c: c.white_elo > 2600)) == []
+    db[1].headers.update(White="New", WhiteElo="2800")
+    db.mark_dirty(1)
+    db.add()
+    assert db.columns() is columns, "edited rows should be updated in place"
+    assert list(db.query(lambda c: c.equals("White", "New"))) == [1]
+    assert list(db.query(lambda c: c.white_elo > 2600)) == [1]
+    assert len(columns) == 4
+
+
+def test_packed_game(tmp_path):
+    db = core.Database(write_pgn(tmp_path))
+    game = db[1]
+    game.variations[0].nags.add(1)
+    game.variations[0].starting_comment = "starting"
+    game.variations[0].variations[1].comment = "side"
+    promotion = core.chess.Move.from_uci("a7a8q")
+    game.variations[0].variations[1].add_variation(promotion)
+    db.mark_dirty(1)
+
+    text = str(game)
+    assert db[0] is not game
+    assert isinstance(db.edited[1], core.PackedGame), "idle games should be packed"
+    assert isinstance(db.cache[0], core.PackedGame)
+    assert str(db.load(1)) == text
+    assert str(db[1]) == text
+    assert db[1] is db[1]
+
+
+def test_packed_database(tmp_path):
+    db = core.Database(write_pgn(tmp_path))
+    db[1].variations[0].comment = "packed"
+    db.mark_dirty(1)
+    texts = [str(game) for game in db]
+    db.export(tmp_path / "games.wcdb", workers=1)
+
+    packed = core.Database(tmp_path / "games.wcdb")
+    assert packed.packed and len(packed) == 3
+    assert [str(game) for game in packed] == texts
+    assert packed.headers(2) == dict(db[2].headers)
+    assert list(packed.query(lambda c: c.result == c.RESULTS["0-1"])) == [2]
+
+    packed[2].headers["Event"] = "Changed"
+    packed.mark_dirty(2)
+    packed.save()
+    assert core.Database(tmp_path / "games.wcdb").headers(2)["Event"] == "Changed"
+
+    packed.save(str(tmp_path / "back.pgn"))
+    back = core.Database(tmp_path / "back.pgn")
+    assert not back.packed
+    assert [str(game) for game in back] == texts[:2] + [str(packed[2])]
+
+
+def test_saved_file_modes(tmp_path, monkeypatch):
+    path = write_pgn(tmp_path)
+    path.chmod(0o640)
+    db = core.Database(path)
+    db.mark_dirty(0)
+    db.save()
+    assert path.stat().st_mode & 0o777 == 0o640
+    sidecar = core.GameIndex.sidecar(path)
+    assert os.stat(sidecar).st_mode & 0o777 == 0o666 & ~core.UMASK
+
+    file = tmp_path / "games.wcdb"
+    db.export(file, workers=1)
+    file.chmod(0o640)
+    packed = core.Database(file)
+    old = packed.index
+    replace = os.replace
+
+    def check_replace(temp, target):
+        assert old.mmap is None, "the mapped file should be closed first"
+        replace(temp, target)
+
+    monkeypatch.setattr(os, "replace", check_replace)
+    packed.mark_dirty(1)
+    packed.save()
+    assert packed.index is not old and packed.packed and len(packed) == 3
+    assert file.stat().st_mode & 0o777 == 0o640
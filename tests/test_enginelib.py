@@ -0,0 +1,37 @@
+import chess
+
+from .context import lib
+
+AnalysisStore = lib.enginelib.AnalysisStore
+format_line = lib.enginelib.format_line
+
+
+def test_analysis_store():
+    store = AnalysisStore()
+    board = chess.Board()
+    assert store.get(board, "engine") is None
+
+    lines = [("+23", 10, ["e2e4", "e7e5"]), ("+15", 10, ["d2d4"])]
+    store.put(board, "engine", 10, lines)
+    assert store.get(board, "engine") == (10, lines)
+    assert store.get(board, "other engine") is None
+
+    # Only a deeper analysis replaces the stored one
+    store.put(board, "engine", 8, [("+40", 8, ["g1f3"])])
+    assert store.get(board, "engine") == (10, lines)
+    store.put(board, "engine", 12, [("+30", 12, ["e2e4"])])
+    assert store.get(board, "engine")[0] == 12
+
+    # The same position reached by other moves shares the analysis
+    transposed = chess.Board()
+    for move in ["g1f3", "g8f6", "f3g1", "f6g8"]:
+        transposed.push_uci(move)
+    assert store.get(transposed, "engine")[0] == 12
+
+
+def test_format_line():
+    board = chess.Board()
+    pv = [chess.Move.from_uci("e2e4"), chess.Move.from_uci("e7e5")]
+    assert format_line(board, "+23", 10, pv) == "+0.23 10 1. e4 e5"
+    board.push(pv[0])
+    assert format_line(board, "+23", 10, pv[1:]) == "-0.23 10 1...e5"
@@ -0,0 +1,39 @@
+import time
+
+from .context import lib
+
+FrameProfiler = lib.fpslib.FrameProfiler
+percentile = lib.fpslib.percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 100
+    assert percentile([], 0.5) == 0.0
+
+
+def test_nested_phases():
+    profiler = FrameProfiler(window=10)
+    with profiler.phase("events"):
+        with profiler.phase("board"):
+            time.sleep(0.02)
+    profiler.end_frame()
+    board, events = profiler.frames["board"][0], profiler.frames["events"][0]
+    assert board >= 0.02, "Fails timing phase"
+    assert events < 0.01, "Fails leaving out nested phase"
+    assert profiler.frames["frame"][0] == board + events
+    assert profiler.stats()["board"]["p50"] == round(board * 1000, 3)
+
+    for _ in range(20):
+        profiler.end_frame()
+    assert len(profiler.frames["board"]) == 10, "Fails rolling window"
+
+
+def test_disabled_profiler():
+    profiler = FrameProfiler(enabled=False)
+    with profiler.phase("board"):
+        pass
+    profiler.end_frame()
+    assert profiler.current["board"] == 0.0
+    assert not profiler.frames["frame"]
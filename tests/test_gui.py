@@ -0,0 +1,105 @@
+import os
+from threading import Lock
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from .context import JSObj, gui, lib
+
+SQUARE_SIZE = 68
+RED = (255, 0, 0, 255)
+GREY = (21, 21, 21, 255)
+
+
+class TGUI(gui.GUI):
+    def __init__(self):
+        self.dirty_rects = []
+        self.frame_requested = False
+        self.display_lock = Lock()
+        self.screen = pygame.Surface((SQUARE_SIZE * 8, SQUARE_SIZE * 8))
+        self.backgrounds = 0
+
+    def background(self, set_arrows=True):
+        self.backgrounds += 1
+        self.screen.fill(GREY)
+
+    def draw_square(self, x, y):
+        pass
+
+    def set_arrows(self):
+        pass
+
+    def textlib_process_mouse_over(self, pos):
+        pass
+
+
+def test_drag_layer():
+    pygame.display.init()
+    piece = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
+    piece.fill(RED)
+    tgui = TGUI()
+    tgui.is_promoting = False
+    tgui.button_pressed = {1: True, 2: False, 3: False}
+    tgui.beg_click = (4, 6)
+    tgui.piece_at = {(4, 6): "P"}
+    tgui.piece_to_img = {"P": piece}
+    tgui.drag_layer = None
+
+    tgui.mouse_over(JSObj({"pos": (100, 100)}))
+    assert tgui.drag_layer is not None and tgui.backgrounds == 1
+    assert tgui.screen.get_at((100, 100)) == RED
+
+    tgui.dirty_rects = []
+    tgui.mouse_over(JSObj({"pos": (300, 300)}))
+    assert tgui.backgrounds == 1, "Fails reusing the drag layer"
+    assert tgui.screen.get_at((100, 100)) == GREY, "Fails erasing the piece"
+    assert tgui.screen.get_at((300, 300)) == RED
+    assert tgui.dirty_rects == [
+        pygame.Rect(66, 66, SQUARE_SIZE, SQUARE_SIZE),
+        pygame.Rect(266, 266, SQUARE_SIZE, SQUARE_SIZE),
+    ]
+
+
+def test_request_frame():
+    pygame.display.init()
+    pygame.event.clear()
+    tgui = TGUI()
+    rects = [pygame.Rect(0, 0, 10, 10), pygame.Rect(10, 0, 10, 10)]
+    tgui.invalidate(rects[0])
+    tgui.invalidate(rects[1])
+    tgui.request_frame()
+    assert len(pygame.event.get(gui.FRAME_EVENT)) == 1, "Fails posting one frame"
+    assert tgui.dirty_rects == rects
+
+    tgui.invalidate_all()
+    tgui.invalidate(rects[0])
+    assert tgui.dirty_rects is None, "Fails updating the whole screen"
+
+    # Requests made while the frame is drawn are part of that frame
+    refreshed = []
+    tgui.manager = JSObj({"update": lambda time_delta: tgui.request_frame()})
+    tgui.draw_ui = tgui.draw_profile = lambda: None
+    tgui.refresh = lambda: refreshed.append(tgui.dirty_rects)
+    tgui.profiler = lib.fpslib.FrameProfiler(enabled=False)
+    tgui.draw_frame(0.01)
+    assert refreshed == [None] and not tgui.frame_requested
+    assert pygame.event.get(gui.FRAME_EVENT) == []
+    tgui.invalidate(rects[0])
+    assert len(pygame.event.get(gui.FRAME_EVENT)) == 1
+
+    # A frame which failed to draw doesn't block the next requests
+    tgui.frame_requested = False
+
+    def fail():
+        raise ValueError
+
+    tgui.draw_ui = fail
+    try:
+        tgui.draw_frame(0.01)
+        assert False, "ValueError should have been raised"
+    except ValueError:
+        assert not tgui.frame_requested
+    pygame.event.clear()
+    tgui.request_frame()
+    assert len(pygame.event.get(gui.FRAME_EVENT)) == 1
@@ -1,5 +1,6 @@
 import chess
 import chess.pgn
+import pygame
 
 from .context import lib
 
@@ -116,3 +117,123 @@ def test_shift_variation_menu():
     ]
 
     assert shift_variation_menu(old_menu_coords, 10) == new_menu_coords
+
+
+def test_render_cached():
+    class Font:
+        renders = 0
+
+        def render(self, text, antialias, color, background):
+            Font.renders += 1
+            return (text, color, background)
+
+    class TextGUI(GUI):
+        text_cache_size = 2
+
+    font = Font()
+    gui = TextGUI()
+    first = gui.render_cached(font, "1. e4 e5", (255, 255, 255), (21, 21, 21))
+    assert gui.render_cached(font, "1. e4 e5", (255, 255, 255), (21, 21, 21)) is first
+    assert (gui.text_cache_hits, gui.text_cache_misses) == (1, 1)
+
+    gui.render_cached(font, "1. e4 e5", (255, 255, 255), (0, 0, 0))
+    gui.render_cached(font, "2. Nf3", (255, 255, 255), (21, 21, 21))
+    assert Font.renders == 3
+    assert len(gui.text_cache) == 2
+    gui.render_cached(font, "1. e4 e5", (255, 255, 255), (21, 21, 21))
+    assert Font.renders == 4
+
+
+def test_move_text_history_cache():
+    class HistoryGUI(GUI):
+        def __init__(self):
+            self.variation_path = [0]
+            self.replayed = []
+
+        def board_at(self, node):
+            self.replayed.append(node)
+            return node.board()
+
+    game = chess.pgn.Game()
+    head = game
+    for m in ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5"]:
+        head = head.add_main_variation(chess.Move.from_uci(m))
+    gui = HistoryGUI()
+    assert gui.move_text_history(game) == ["1. e4 e5", "2. Nf3 Nc6", "3. Bb5"]
+    assert gui.replayed == [game]
+
+    # Extending the line only converts the new move
+    head.add_main_variation(chess.Move.from_uci("a7a6"))
+    assert gui.move_text_history(game)[-1] == "3. Bb5 a6"
+    assert gui.replayed == [game, head]
+
+    # A new variation marks its row and the path switches to it
+    fork = game.variations[0].variations[0]
+    fork.parent.add_variation(chess.Move.from_uci("c7c5"))
+    assert gui.move_text_history(game) == ["*1. e4 e5", "2. Nf3 Nc6", "3. Bb5 a6"]
+    gui.variation_path = [0, 1]
+    assert gui.move_text_history(game) == ["*1. e4 c5"]
+    assert gui.replayed[-1] is game.variations[0]
+    rows = GUI._GUI__get_move_text_history(game, 0.5, [1])
+    assert gui.move_text_history(game) == [row.lstrip("\t") for row in rows]
+
+
+def test_follow_row():
+    class ScrollGUI(GUI):
+        hist_rows = 15
+
+    gui = ScrollGUI()
+    moves = [f"{i}. e4 e5" for i in range(1, 101)]
+    gui.move = 100
+    assert gui.follow_row(moves) == 85, "Fails showing the last row"
+    gui.history_top = 80
+    gui.move = 90.5
+    assert gui.follow_row(moves) == 80, "Fails keeping a row in view"
+    gui.move = 10.5
+    assert gui.follow_row(moves) == 3, "Fails centering a row out of view"
+    gui.move = 0
+    assert gui.follow_row(moves[:5]) == 0
+
+
+def test_variation_labels():
+    class LabelGUI(GUI, lib.treelib.GUI):
+        def board_at(self, node):
+            return node.board()
+
+    game = chess.pgn.Game()
+    node = game.add_main_variation(chess.Move.from_uci("e2e4"))
+    node.add_variation(chess.Move.from_uci("e7e5"))
+    node.add_variation(chess.Move.from_uci("c7c5"))
+    gui = LabelGUI()
+    assert gui.variation_labels(node) == ["1... e5 ", "1... c5 "]
+    assert gui.variation_labels(game) == ["1. e4 "]
+
+    # The sans of the line in the history are reused
+    gui.history_cache = ([node, node.variations[0]], [], ["e4", "cached"], [])
+    assert gui.variation_labels(node) == ["1... cached ", "1... c5 "]
+
+
+def test_variation_menu_rows():
+    class Font:
+        def render(self, text, antialias, color, background):
+            return pygame.Surface((len(text), 10))
+
+    class MenuGUI(GUI, lib.treelib.GUI):
+        SQUARE_SIZE = 68
+        font_small = Font()
+        _initial_variation_y = 100
+
+        def board_at(self, node):
+            return node.board()
+
+    game = chess.pgn.Game()
+    gui = MenuGUI()
+    gui.node = game.add_main_variation(chess.Move.from_uci("e2e4"))
+    gui.node.add_variation(chess.Move.from_uci("e7e5"))
+    gui.node.add_variation(chess.Move.from_uci("c7c5"))
+    rows = gui.variation_menu_rows()
+    assert len(rows) == 2 and gui.variation_menu_rows() is rows
+
+    # A move played at the node adds an item to the menu
+    gui.node.add_variation(chess.Move.from_uci("e7e6"))
+    assert len(gui.variation_menu_rows()) == 3
@@ -0,0 +1,59 @@
+import io
+
+import chess.pgn
+
+from .context import lib
+
+TreeIndex = lib.treelib.TreeIndex
+
+PGN = "1. e4 (1. d4 d5 (1... Nf6 2. c4) 2. c4) 1... e5 2. Nf3 (2. f4 exf4) 2... Nc6 *"
+
+
+def walk_path(game, path):
+    node = game
+    for slot in path:
+        node = node.variations[slot]
+    return node
+
+
+def test_tree_index():
+    game = chess.pgn.read_game(io.StringIO(PGN))
+    index = TreeIndex(game)
+    mainline = [game] + list(game.mainline())
+    assert index.lines[0] == mainline
+    assert index.line_plies(0) == range(0, 5)
+    assert index.end(game) is mainline[-1]
+
+    nodes = [game]
+    for node in nodes:
+        nodes.extend(node.variations)
+        path = index.path(node)
+        assert walk_path(game, path) is node
+        assert index.ply(node) == len(path)
+    assert len(index.entries) == len(nodes) == 12
+
+    king_gambit = game.variations[0].variations[0].variations[1]
+    assert index.slot(king_gambit) == 1
+    assert index.path(king_gambit.variations[0]) == [0, 0, 1, 0]
+    assert index.line(king_gambit.variations[0])[0] is king_gambit
+    assert index.follow(game, [0, 0, 1]) is king_gambit.variations[0]
+    assert index.follow(game, [1, 0, 1]) is game.variations[1].end()
+
+
+def test_tree_index_edits():
+    game = chess.pgn.read_game(io.StringIO(PGN))
+    index = TreeIndex(game)
+    end = index.end(game)
+    new = end.add_variation(chess.Move.from_uci("f1b5"))
+    index.add(new)
+    assert index.end(game) is new and index.ply(new) == 5
+
+    sideline = end.add_variation(chess.Move.from_uci("f1c4"))
+    index.add(sideline)
+    assert index.path(sideline) == [0, 0, 0, 0, 1]
+
+    main = end.add_main_variation(chess.Move.from_uci("d2d4"))
+    index.add(main)
+    assert index.end(game) is main
+    assert index.path(sideline) == [0, 0, 0, 0, 2]
+    assert index.path(new) == [0, 0, 0, 0, 1]